@@ -0,0 +1,50 @@
+"""Benchmark sent_date formatting throughput.
+
+Compares the original per-message path (fromtimestamp + a new IST timezone
+object + strftime for every message) with the batched SentDateFormatter.
+
+    python benchmarks/bench_formatting.py [rows]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import SentDateFormatter, DEFAULT_DATE_FORMAT
+
+
+def per_message_format(sent_timestamp):
+    dt_utc = datetime.fromtimestamp(int(sent_timestamp) / 1000, tz=timezone.utc)
+    ist_tz = timezone(timedelta(hours=5, minutes=30))
+    return dt_utc.astimezone(ist_tz).strftime('%d/%m/%Y %H:%M:%S')
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(0)
+    # A year of sent mail, in arrival order
+    start = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    timestamps = sorted(start + random.randrange(365 * 86400 * 1000) for _ in range(rows))
+    
+    started = time.perf_counter()
+    baseline = [per_message_format(ts) for ts in timestamps]
+    baseline_seconds = time.perf_counter() - started
+    
+    formatter = SentDateFormatter('Asia/Kolkata', DEFAULT_DATE_FORMAT)
+    started = time.perf_counter()
+    batched = formatter.format_batch(timestamps)
+    batched_seconds = time.perf_counter() - started
+    
+    assert batched == baseline, "batched output differs from per-message output"
+    
+    print(f"rows:        {rows}")
+    print(f"per-message: {baseline_seconds:.2f}s ({rows / baseline_seconds:,.0f} rows/s)")
+    print(f"batched:     {batched_seconds:.2f}s ({rows / batched_seconds:,.0f} rows/s)")
+    print(f"speedup:     {baseline_seconds / batched_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
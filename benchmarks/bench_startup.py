@@ -0,0 +1,85 @@
+"""Benchmark cold start, first request latency and first Gmail client build.
+
+Each run starts a fresh interpreter, imports the app and sends its first
+requests straight to the ASGI app (no server or HTTP client needed). The
+first /auth/login and the first Gmail client build are where the lazily
+imported Google stack is paid for, so they are timed separately.
+
+    python benchmarks/bench_startup.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r'''
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def get(path):
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": [], "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 8000)}
+    messages = []
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(message):
+        messages.append(message)
+    began = time.perf_counter()
+    await main.app(scope, receive, send)
+    return time.perf_counter() - began
+
+google_loaded_at_import = "googleapiclient.discovery" in sys.modules
+first = asyncio.run(get("/"))
+static = asyncio.run(get("/static/dashboard.js"))
+login = asyncio.run(get("/auth/login"))
+
+def build_client():
+    began = time.perf_counter()
+    from google.oauth2.credentials import Credentials
+    credentials = Credentials(token="benchmark")
+    if hasattr(main, "build_gmail_service"):
+        main.build_gmail_service(credentials)
+    else:
+        # Revisions before lazy loading built the client inline
+        main.build("gmail", "v1", credentials=credentials)
+    return time.perf_counter() - began
+
+first_client = build_client()
+next_client = build_client()
+print(json.dumps({
+    "import": imported - started,
+    "first_request": first,
+    "static_asset": static,
+    "first_login": login,
+    "first_gmail_client": first_client,
+    "next_gmail_client": next_client,
+    "google_stack_loaded": google_loaded_at_import
+}))
+'''
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = []
+    for _ in range(runs):
+        started = os.times().elapsed
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        total = os.times().elapsed - started
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process'] = total
+        results.append(result)
+    
+    for key in ('process', 'import', 'first_request', 'static_asset', 'first_login', 'first_gmail_client', 'next_gmail_client'):
+        values = [r[key] * 1000 for r in results]
+        print(f"{key:18} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+    print(f"google client stack imported at startup: {results[0]['google_stack_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
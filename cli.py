@@ -0,0 +1,170 @@
+"""Headless export runner for scheduled (cron) jobs.
+
+Runs the same pipeline as the web app for one or many accounts using refresh
+tokens from the token store (see TOKEN_STORE_PATH), writes the files to an
+output directory and prints a JSON run summary on stdout.
+
+    python cli.py --all --start-date 2025-01-01 --end-date 2025-01-31 --output-dir exports
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+# main prints its config on import; keep stdout for the run summary
+with contextlib.redirect_stdout(sys.stderr):
+    import main
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export Gmail sent mail without the web UI")
+    accounts = parser.add_mutually_exclusive_group(required=True)
+    accounts.add_argument("--users", nargs="+", metavar="EMAIL", help="accounts to export")
+    accounts.add_argument("--all", action="store_true", help="export every account in the token store")
+    parser.add_argument("--tokens", default=main.TOKEN_STORE_PATH or "tokens.json", help="token store JSON file")
+    parser.add_argument("--start-date", help="first day to export, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--end-date", help="last day to export, YYYY-MM-DD (default: start date)")
+    parser.add_argument("--output-dir", default="exports", help="directory for export files")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="export file format")
+    parser.add_argument("--timezone", default=main.DEFAULT_TIMEZONE, help="IANA timezone for sent_date")
+    parser.add_argument("--date-format", default=main.DEFAULT_DATE_FORMAT, help="strftime format for sent_date")
+    parser.add_argument("--concurrency", type=int, default=2, help="accounts exported in parallel")
+    parser.add_argument("--summary", help="also write the run summary JSON to this file")
+    return parser.parse_args(argv)
+
+
+def account_directory_name(user_email):
+    """Filesystem safe directory name for an account (the full address, lowercased)"""
+    return re.sub(r'[^a-z0-9@._+-]', '_', user_email.lower())
+
+
+def export_account(user_email, creds_data, options):
+    """Run one account's export in a worker process and return its summary"""
+    # Keep stdout for the machine readable summary
+    with contextlib.redirect_stdout(sys.stderr):
+        # Each worker gets an equal slice of the project quota
+        main.quota_scheduler = main.QuotaScheduler(
+            main.GMAIL_QUOTA_UNITS_PER_SECOND / options['concurrency'],
+            main.GMAIL_QUOTA_BURST / options['concurrency']
+        )
+        main.init_export_db()
+
+        start_date = date.fromisoformat(options['start_date'])
+        end_date = date.fromisoformat(options['end_date'])
+        started = time.perf_counter()
+
+        generation_id = main.create_generation(
+            {'email': user_email, 'credentials': creds_data},
+            'range',
+            start_date,
+            end_date + timedelta(days=1),
+            f"{start_date.isoformat()}_to_{end_date.isoformat()}",
+            tz_name=options['timezone'],
+            date_format=options['date_format'],
+            output_format=options['format']
+        )
+        asyncio.run(main.process_emails_background(generation_id))
+        status = main.generation_status[generation_id]
+
+        # File names only carry the local part, so each account gets its own directory
+        account_dir = os.path.join(options['output_dir'], account_directory_name(user_email))
+        files = []
+        for file_info in status['completed_files']:
+            if 's3_key' in file_info:
+                # Already streamed to the object store
+                files.append(f"s3://{main.EXPORT_S3_BUCKET}/{file_info['s3_key']}")
+                continue
+            os.makedirs(account_dir, exist_ok=True)
+            path = os.path.join(account_dir, file_info['filename'])
+            with open(path, 'w', newline='') as f:
+                f.write(file_info['csv_content'])
+            files.append(path)
+
+        flow = status['quota_flow']
+        result_status = status['status']
+        if result_status == 'completed' and status['fetch_errors']:
+            # Some windows were abandoned or cut short - the files are missing mail
+            result_status = 'incomplete'
+        return {
+            'user': user_email,
+            'status': result_status,
+            'message': status['message'],
+            'fetch_errors': status['fetch_errors'],
+            'email_count': status['total_email_count'],
+            'files': files,
+            'windows': len(status['windows']),
+            'duration_seconds': round(time.perf_counter() - started, 2),
+            'api_calls': dict(flow['calls'], total=sum(flow['calls'].values())),
+            'quota_units_used': flow['units_used']
+        }
+
+
+def run(args):
+    stored = main.load_stored_credentials(args.tokens)
+    users = sorted(stored) if args.all else args.users
+    missing = [user for user in users if user not in stored]
+
+    start_date = date.fromisoformat(args.start_date) if args.start_date else date.today() - timedelta(days=1)
+    end_date = date.fromisoformat(args.end_date) if args.end_date else start_date
+    if end_date < start_date:
+        raise SystemExit("--end-date must not be before --start-date")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    concurrency = max(1, min(args.concurrency, len(users) or 1))
+    options = {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'output_dir': args.output_dir,
+        'format': args.format,
+        'timezone': args.timezone,
+        'date_format': args.date_format,
+        'concurrency': concurrency
+    }
+
+    started = time.perf_counter()
+    results = [{'user': user, 'status': 'failed', 'message': 'No stored credentials'} for user in missing]
+    runnable = [user for user in users if user in stored]
+    with ProcessPoolExecutor(max_workers=concurrency) as pool:
+        futures = {user: pool.submit(export_account, user, stored[user], options) for user in runnable}
+        for user, future in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({'user': user, 'status': 'failed', 'message': f'Error: {e}'})
+
+    return {
+        'start_date': options['start_date'],
+        'end_date': options['end_date'],
+        'format': args.format,
+        'duration_seconds': round(time.perf_counter() - started, 2),
+        'users': len(users),
+        'succeeded': sum(1 for r in results if r['status'] == 'completed'),
+        'incomplete': sum(1 for r in results if r['status'] == 'incomplete'),
+        'failed': sum(1 for r in results if r['status'] == 'failed'),
+        'email_count': sum(r.get('email_count', 0) for r in results),
+        'api_calls': sum(r.get('api_calls', {}).get('total', 0) for r in results),
+        'results': results
+    }
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    summary = run(args)
+
+    output = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            f.write(output)
+    print(output)
+
+    return 1 if summary['failed'] or summary['incomplete'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
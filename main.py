@@ -1,12 +1,9 @@
 from fastapi import FastAPI, Request, HTTPException, Query
-from fastapi.responses import HTMLResponse, StreamingResponse, RedirectResponse, JSONResponse
-from google.auth.transport.requests import Request as GoogleRequest
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from datetime import datetime, date, timezone, timedelta
+from fastapi.responses import HTMLResponse, StreamingResponse, RedirectResponse, JSONResponse, Response
+from datetime import datetime, date, timedelta
 import secrets
+import hashlib
+import html
 import email
 import csv
 import io
@@ -15,6 +12,19 @@ import os
 from dotenv import load_dotenv
 import traceback
 import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import sqlite3
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from zoneinfo import ZoneInfo
 
 load_dotenv()
 
@@ -24,6 +34,60 @@ app = FastAPI(title="Email CSV Generator")
 user_sessions = {}
 oauth_states = {}
 generation_status = {}  # Track generation progress
+generation_index = {}  # (account, mode, range, options) -> generation_id, for coalescing
+
+# Finished exports are reused for identical requests until this many seconds pass
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "600"))
+
+# Query planning: target messages per work unit when sharding a date range
+TARGET_WINDOW_MESSAGES = int(os.getenv("TARGET_WINDOW_MESSAGES", "2000"))
+WINDOW_FETCH_CONCURRENCY = int(os.getenv("WINDOW_FETCH_CONCURRENCY", "4"))  # windows fetched at once per job
+
+# Summary report columns
+RECIPIENT_SUMMARY_COLUMNS = ['recipient_email', 'recipient_name', 'message_count', 'thread_count', 'first_sent_date', 'last_sent_date']
+THREAD_SUMMARY_COLUMNS = ['thread_id', 'message_count', 'recipient_count', 'first_sent_date', 'last_sent_date']
+
+# Local indexed store of exported records, queried by /api/query
+EXPORT_DB_PATH = os.getenv("EXPORT_DB_PATH", "exports.db")
+QUERY_MAX_LIMIT = 1000
+
+# sent_date formatting, overridable per request with timezone / date_format
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Asia/Kolkata")
+DEFAULT_DATE_FORMAT = os.getenv("DEFAULT_DATE_FORMAT", "%d/%m/%Y %H:%M:%S")
+
+# Cache headers for precompiled pages and versioned static assets
+PAGE_CACHE_CONTROL = "public, max-age=3600"
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Opt-in job profiling (profile=true on start-generation)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# Shared Gmail project quota, arbitrated across concurrent generations
+GMAIL_QUOTA_UNITS_PER_SECOND = float(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", "20000"))  # Google default: 1.2M/min
+GMAIL_QUOTA_BURST = float(os.getenv("GMAIL_QUOTA_BURST", str(GMAIL_QUOTA_UNITS_PER_SECOND)))
+GMAIL_QUOTA_COST = {'getProfile': 1, 'list': 5, 'get': 5, 'history': 2}
+SCHEDULER_WEIGHTS = {'single': 4, 'range': 1, 'multi': 1}  # Small single month exports go first
+GMAIL_DAILY_QUOTA_UNITS = int(os.getenv("GMAIL_DAILY_QUOTA_UNITS", "0"))  # 0 = no daily cap to track
+QUOTA_RESET_TZ = ZoneInfo("America/Los_Angeles")  # Google quotas reset at midnight Pacific
+
+# Progress: share of the bar before fetching starts, and EWMA throughput tuning
+FETCH_PROGRESS_START = 5
+FETCH_PROGRESS_END = 95
+THROUGHPUT_SAMPLE_SECONDS = 1.0
+THROUGHPUT_EWMA_ALPHA = 0.3
+
+# Optional S3-compatible sink for export files (set EXPORT_S3_BUCKET to enable)
+EXPORT_S3_BUCKET = os.getenv("EXPORT_S3_BUCKET")
+EXPORT_S3_ENDPOINT_URL = os.getenv("EXPORT_S3_ENDPOINT_URL")  # e.g. a MinIO server
+EXPORT_S3_REGION = os.getenv("EXPORT_S3_REGION")
+EXPORT_S3_PREFIX = os.getenv("EXPORT_S3_PREFIX", "exports/")
+EXPORT_S3_PART_SIZE = int(os.getenv("EXPORT_S3_PART_SIZE", str(8 * 1024 * 1024)))
+EXPORT_S3_PRESIGN = os.getenv("EXPORT_S3_PRESIGN", "true").lower() in ("true", "1")  # false = proxy stream
+EXPORT_S3_URL_TTL = int(os.getenv("EXPORT_S3_URL_TTL", "900"))
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Optional on-disk store of refresh tokens for headless (cli.py) exports
+TOKEN_STORE_PATH = os.getenv("TOKEN_STORE_PATH")
 
 # Google OAuth config
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
@@ -41,16 +105,39 @@ client_config = {
     }
 }
 
-@app.get("/", response_class=HTMLResponse)
-async def home():
-    return HTMLResponse(f"""
+@app.on_event("startup")
+async def startup():
+    init_export_db()
+    if EXPORT_S3_BUCKET:
+        # Fail fast if boto3 is missing, the credentials are bad or the bucket is unreachable
+        get_s3_client().head_bucket(Bucket=EXPORT_S3_BUCKET)
+
+# The Google client stack is imported on first use to keep cold starts fast
+@lru_cache(maxsize=None)
+def get_gmail_discovery_document():
+    """Bundled Gmail v1 discovery document, read once per process"""
+    from googleapiclient import discovery_cache
+    return discovery_cache.get_static_doc('gmail', 'v1')
+
+def build_gmail_service(credentials):
+    """Gmail API client built from the bundled discovery document (no network fetch)"""
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(get_gmail_discovery_document(), credentials=credentials)
+
+def create_oauth_flow():
+    from google_auth_oauthlib.flow import Flow
+    flow = Flow.from_client_config(client_config, scopes=['https://www.googleapis.com/auth/gmail.readonly'])
+    flow.redirect_uri = REDIRECT_URI
+    return flow
+
+HOME_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
         <title>Email CSV Generator</title>
         <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
         <style>
-            .hero {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; min-height: 100vh; display: flex; align-items: center; }}
+            .hero { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; min-height: 100vh; display: flex; align-items: center; }
         </style>
     </head>
     <body>
@@ -69,16 +156,17 @@ async def home():
         </div>
     </body>
     </html>
-    """)
+    """
+HOME_HTML_BYTES = HOME_HTML.encode()
+
+@app.get("/", response_class=HTMLResponse)
+async def home():
+    return HTMLResponse(content=HOME_HTML_BYTES, headers={"Cache-Control": PAGE_CACHE_CONTROL})
 
 @app.get("/auth/login")
 async def login():
     try:
-        flow = Flow.from_client_config(
-            client_config,
-            scopes=['https://www.googleapis.com/auth/gmail.readonly']
-        )
-        flow.redirect_uri = REDIRECT_URI
+        flow = create_oauth_flow()
         
         state = secrets.token_urlsafe(32)
         oauth_states[state] = True
@@ -101,17 +189,19 @@ async def callback(code: str = Query(...), state: str = Query(...)):
         if state not in oauth_states:
             raise HTTPException(status_code=400, detail="Invalid state")
         
-        flow = Flow.from_client_config(client_config, scopes=['https://www.googleapis.com/auth/gmail.readonly'])
-        flow.redirect_uri = REDIRECT_URI
+        flow = create_oauth_flow()
         flow.fetch_token(code=code)
         
         credentials = flow.credentials
-        service = build('gmail', 'v1', credentials=credentials)
+        service = build_gmail_service(credentials)
         profile = service.users().getProfile(userId='me').execute()
         user_email = profile['emailAddress']
         
         print(f"Successfully authenticated user: {user_email}")
         
+        if TOKEN_STORE_PATH and credentials.refresh_token:
+            await asyncio.to_thread(save_stored_credentials, TOKEN_STORE_PATH, user_email, credentials)
+        
         # Store user session
         session_id = secrets.token_urlsafe(32)
         user_sessions[session_id] = {
@@ -135,15 +225,299 @@ async def callback(code: str = Query(...), state: str = Query(...)):
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request):
-    session_id = request.cookies.get("session_id")
-    if not session_id or session_id not in user_sessions:
-        return RedirectResponse(url="/")
-    
-    user_email = user_sessions[session_id]['email']
-    
-    return HTMLResponse(f"""
+DASHBOARD_JS = """
+let generationId = null;
+let progressInterval = null;
+
+// Exports start in 2024; offer every year up to the current one
+const FIRST_EXPORT_YEAR = 2024;
+
+function populateYearOptions() {
+    const currentYear = new Date().getFullYear();
+    ['singleYear', 'multiYear'].forEach(id => {
+        const select = document.getElementById(id);
+        for (let year = FIRST_EXPORT_YEAR; year <= currentYear; year++) {
+            select.add(new Option(year, year));
+        }
+    });
+}
+
+populateYearOptions();
+
+async function startSingleMonthGeneration() {
+    const month = document.getElementById('singleMonth').value;
+    const year = document.getElementById('singleYear').value;
+
+    // Validate date (only Dec 2024+)
+    const selectedDate = new Date(year, month - 1, 1);
+    const minDate = new Date(2024, 11, 1); // December 2024
+    const maxDate = new Date(); // Today
+
+    if (selectedDate < minDate) {
+        alert('Email collection starts from December 2024!');
+        return;
+    }
+
+    if (selectedDate > maxDate) {
+        alert('Cannot export emails from future months!');
+        return;
+    }
+
+    // Hide buttons, show progress
+    hideButtons();
+    document.getElementById('progressSection').style.display = 'block';
+    document.getElementById('successSection').style.display = 'none';
+
+    try {
+        updateProgress(10, 'Starting single month email collection...');
+
+        const response = await fetch('/api/start-generation', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                month: parseInt(month), 
+                year: parseInt(year),
+                mode: 'single'
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to start generation');
+        }
+
+        const data = await response.json();
+        generationId = data.generation_id;
+
+        startProgressPolling();
+
+    } catch (error) {
+        showError('Failed to start generation: ' + error.message);
+    }
+}
+
+async function startMultiMonthGeneration() {
+    const month = document.getElementById('multiMonth').value;
+    const year = document.getElementById('multiYear').value;
+
+    // Validate date (only Dec 2024+)
+    const selectedDate = new Date(year, month - 1, 1);
+    const minDate = new Date(2024, 11, 1); // December 2024
+    const endDate = new Date(); // Today
+
+    if (selectedDate < minDate) {
+        alert('Email collection starts from December 2024!');
+        return;
+    }
+
+    if (selectedDate > endDate) {
+        alert('Start month cannot be in the future!');
+        return;
+    }
+
+    // Hide buttons, show progress
+    hideButtons();
+    document.getElementById('progressSection').style.display = 'block';
+    document.getElementById('successSection').style.display = 'none';
+
+    try {
+        // Start generation process
+        updateProgress(10, 'Starting multi-month email collection...');
+
+        const response = await fetch('/api/start-generation', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                month: parseInt(month), 
+                year: parseInt(year),
+                mode: 'multi'
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to start generation');
+        }
+
+        const data = await response.json();
+        generationId = data.generation_id;
+
+        // Start polling for progress
+        startProgressPolling();
+
+    } catch (error) {
+        showError('Failed to start generation: ' + error.message);
+    }
+}
+
+async function startRangeGeneration() {
+    const startDate = document.getElementById('rangeStart').value;
+    const endDate = document.getElementById('rangeEnd').value;
+
+    if (!startDate || !endDate) {
+        alert('Please choose both a start and end date!');
+        return;
+    }
+
+    if (endDate < startDate) {
+        alert('End date cannot be before start date!');
+        return;
+    }
+
+    // Hide buttons, show progress
+    hideButtons();
+    document.getElementById('progressSection').style.display = 'block';
+    document.getElementById('successSection').style.display = 'none';
+
+    try {
+        updateProgress(10, 'Starting date range email collection...');
+
+        const response = await fetch('/api/start-generation', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                start_date: startDate,
+                end_date: endDate,
+                mode: 'range'
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to start generation');
+        }
+
+        const data = await response.json();
+        generationId = data.generation_id;
+
+        startProgressPolling();
+
+    } catch (error) {
+        showError('Failed to start generation: ' + error.message);
+    }
+}
+
+function hideButtons() {
+    ['singleBtn', 'multiBtn', 'rangeBtn'].forEach(id => document.getElementById(id).style.display = 'none');
+}
+
+function showButtons() {
+    ['singleBtn', 'multiBtn', 'rangeBtn'].forEach(id => document.getElementById(id).style.display = 'block');
+}
+
+let downloadedFiles = new Set();
+
+function startProgressPolling() {
+    progressInterval = setInterval(async () => {
+        try {
+            const response = await fetch(`/api/generation-status/${generationId}`);
+            const status = await response.json();
+
+            const queueNote = status.queue_position ? ` (waiting for Gmail quota: position ${status.queue_position}, ~${Math.ceil(status.expected_wait_seconds)}s)` : '';
+            const etaNote = status.eta_seconds !== null && status.eta_seconds !== undefined
+                ? ` · ${status.throughput_messages_per_second} emails/s, ~${formatDuration(status.eta_seconds)} left` : '';
+            updateProgress(status.progress, status.message + queueNote + etaNote);
+
+            // Handle downloads based on mode
+            if (status.mode === 'single') {
+                // Single file download when complete
+                if (status.status === 'completed' && status.completed_files && status.completed_files.length > 0) {
+                    clearInterval(progressInterval);
+                    showSuccess(1, status.total_email_count);
+                    showSummaryLinks(status.completed_files);
+                    // Auto-download the single file
+                    setTimeout(() => {
+                        downloadFile(0, status.completed_files[0].filename);
+                    }, 500);
+                }
+            } else {
+                // Multi-month mode - single combined file when complete
+                if (status.status === 'completed' && status.completed_files && status.completed_files.length > 0) {
+                    clearInterval(progressInterval);
+                    showSuccess(1, status.total_email_count);
+                    showSummaryLinks(status.completed_files);
+                    // Auto-download the combined file
+                    setTimeout(() => {
+                        downloadFile(0, status.completed_files[0].filename);
+                    }, 500);
+                }
+            }
+
+            if (status.status === 'completed' && (!status.completed_files || status.completed_files.length === 0)) {
+                clearInterval(progressInterval);
+                showSuccess(0, 0);
+            } else if (status.status === 'failed') {
+                clearInterval(progressInterval);
+                showError(status.message);
+            }
+        } catch (error) {
+            console.error('Error polling status:', error);
+        }
+    }, 1000); // Poll every second
+}
+
+function formatDuration(seconds) {
+    if (seconds < 60) return `${Math.ceil(seconds)}s`;
+    if (seconds < 3600) return `${Math.floor(seconds / 60)}m ${Math.ceil(seconds % 60)}s`;
+    return `${Math.floor(seconds / 3600)}h ${Math.floor((seconds % 3600) / 60)}m`;
+}
+
+function downloadFile(fileIndex, filename) {
+    console.log(`Auto-downloading: ${filename}`);
+    window.location.href = `/api/download/${generationId}?file_index=${fileIndex}`;
+}
+
+function updateProgress(percent, message) {
+    document.getElementById('progressBar').style.width = percent + '%';
+    document.getElementById('progressText').textContent = Math.round(percent) + '%';
+    document.getElementById('statusText').textContent = message;
+}
+
+function showSuccess(fileCount, totalEmailCount) {
+    document.getElementById('progressSection').style.display = 'none';
+    document.getElementById('successSection').style.display = 'block';
+    document.getElementById('successMessage').textContent = 
+        `Successfully processed ${totalEmailCount} emails in ${fileCount} CSV file. File has been automatically downloaded.`;
+
+    // Hide download button since files are auto-downloaded
+    document.getElementById('downloadBtn').style.display = 'none';
+}
+
+function showSummaryLinks(files) {
+    const container = document.getElementById('summaryLinks');
+    container.innerHTML = '';
+    files.forEach((file, index) => {
+        if (!file.summary) return;
+        const link = document.createElement('a');
+        link.className = 'btn btn-outline-success ms-2';
+        link.href = `/api/download/${generationId}?file_index=${index}`;
+        link.textContent = `Download ${file.summary} summary`;
+        container.appendChild(link);
+    });
+}
+
+function showError(message) {
+    document.getElementById('progressSection').style.display = 'none';
+    showButtons();
+    alert('Error: ' + message);
+}
+
+function resetForm() {
+    document.getElementById('successSection').style.display = 'none';
+    showButtons();
+    generationId = null;
+}
+
+function cancelGeneration() {
+    if (progressInterval) {
+        clearInterval(progressInterval);
+    }
+    // TODO: Send cancel request to server
+    resetForm();
+}
+"""
+DASHBOARD_JS_BYTES = DASHBOARD_JS.encode()
+DASHBOARD_JS_VERSION = hashlib.sha256(DASHBOARD_JS_BYTES).hexdigest()[:12]
+
+# Rendered once at import; only the account email is spliced in per request
+DASHBOARD_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -152,7 +526,7 @@ async def dashboard(request: Request):
     </head>
     <body>
         <div class="container mt-4">
-            <h2>📊 Dashboard - {user_email}</h2>
+            <h2>📊 Dashboard - __USER_EMAIL__</h2>
             <p>Choose how to generate your email CSV files:</p>
             
             <div class="row mt-4">
@@ -182,8 +556,6 @@ async def dashboard(request: Request):
                                 <div class="col-6">
                                     <label>Year:</label>
                                     <select id="singleYear" class="form-select">
-                                        <option value="2024">2024</option>
-                                        <option value="2025">2025</option>
                                     </select>
                                 </div>
                             </div>
@@ -196,7 +568,7 @@ async def dashboard(request: Request):
                     <div class="card">
                         <div class="card-body text-center">
                             <h4>📚 Multiple Months</h4>
-                            <p>Generate single CSV file with all emails from selected month to July 2025</p>
+                            <p>Generate single CSV file with all emails from selected month to today</p>
                             <div class="row mb-3">
                                 <div class="col-6">
                                     <label>Start Month:</label>
@@ -218,8 +590,6 @@ async def dashboard(request: Request):
                                 <div class="col-6">
                                     <label>Year:</label>
                                     <select id="multiYear" class="form-select">
-                                        <option value="2024">2024</option>
-                                        <option value="2025">2025</option>
                                     </select>
                                 </div>
                             </div>
@@ -229,6 +599,28 @@ async def dashboard(request: Request):
                 </div>
             </div>
             
+            <div class="row mt-4">
+                <div class="col-md-6">
+                    <div class="card">
+                        <div class="card-body text-center">
+                            <h4>🗓️ Custom Range</h4>
+                            <p>Generate single CSV file for any start and end date</p>
+                            <div class="row mb-3">
+                                <div class="col-6">
+                                    <label>Start Date:</label>
+                                    <input id="rangeStart" type="date" class="form-control">
+                                </div>
+                                <div class="col-6">
+                                    <label>End Date:</label>
+                                    <input id="rangeEnd" type="date" class="form-control">
+                                </div>
+                            </div>
+                            <button id="rangeBtn" onclick="startRangeGeneration()" class="btn btn-info">Generate Range CSV</button>
+                        </div>
+                    </div>
+                </div>
+            </div>
+            
             <!-- Progress Section -->
             <div id="progressSection" class="row mt-4" style="display:none;">
                 <div class="col-12">
@@ -257,228 +649,40 @@ async def dashboard(request: Request):
                         <h5>✅ Generation Complete!</h5>
                         <p id="successMessage"></p>
                         <button id="downloadBtn" class="btn btn-success">Download CSV</button>
+                        <span id="summaryLinks"></span>
                         <button onclick="resetForm()" class="btn btn-outline-secondary ms-2">Generate Another</button>
                     </div>
                 </div>
             </div>
         </div>
         
-        <script>
-            let generationId = null;
-            let progressInterval = null;
-            
-            async function startSingleMonthGeneration() {{
-                const month = document.getElementById('singleMonth').value;
-                const year = document.getElementById('singleYear').value;
-                
-                // Validate date (only Dec 2024+)
-                const selectedDate = new Date(year, month - 1, 1);
-                const minDate = new Date(2024, 11, 1); // December 2024
-                const maxDate = new Date(2025, 6, 31); // July 2025
-                
-                if (selectedDate < minDate) {{
-                    alert('Email collection starts from December 2024!');
-                    return;
-                }}
-                
-                if (selectedDate > maxDate) {{
-                    alert('Email collection only available up to July 2025!');
-                    return;
-                }}
-                
-                // Hide buttons, show progress
-                document.getElementById('singleBtn').style.display = 'none';
-                document.getElementById('multiBtn').style.display = 'none';
-                document.getElementById('progressSection').style.display = 'block';
-                document.getElementById('successSection').style.display = 'none';
-                
-                try {{
-                    updateProgress(10, 'Starting single month email collection...');
-                    
-                    const response = await fetch('/api/start-generation', {{
-                        method: 'POST',
-                        headers: {{'Content-Type': 'application/json'}},
-                        body: JSON.stringify({{
-                            month: parseInt(month), 
-                            year: parseInt(year),
-                            mode: 'single'
-                        }})
-                    }});
-                    
-                    if (!response.ok) {{
-                        throw new Error('Failed to start generation');
-                    }}
-                    
-                    const data = await response.json();
-                    generationId = data.generation_id;
-                    
-                    startProgressPolling();
-                    
-                }} catch (error) {{
-                    showError('Failed to start generation: ' + error.message);
-                }}
-            }}
-            
-            async function startMultiMonthGeneration() {{
-                const month = document.getElementById('multiMonth').value;
-                const year = document.getElementById('multiYear').value;
-                
-                // Validate date (only Dec 2024+)
-                const selectedDate = new Date(year, month - 1, 1);
-                const minDate = new Date(2024, 11, 1); // December 2024
-                const endDate = new Date(2025, 6, 31); // July 2025
-                
-                if (selectedDate < minDate) {{
-                    alert('Email collection starts from December 2024!');
-                    return;
-                }}
-                
-                if (selectedDate > endDate) {{
-                    alert('Start month cannot be after July 2025!');
-                    return;
-                }}
-                
-                // Calculate months from start to July 2025
-                const monthsToProcess = [];
-                let currentMonth = new Date(selectedDate);
-                while (currentMonth <= endDate) {{
-                    monthsToProcess.push({{
-                        month: currentMonth.getMonth() + 1,
-                        year: currentMonth.getFullYear(),
-                        name: currentMonth.toLocaleString('default', {{ month: 'long', year: 'numeric' }})
-                    }});
-                    currentMonth.setMonth(currentMonth.getMonth() + 1);
-                }}
-                
-                console.log(`Will process ${{monthsToProcess.length}} months:`, monthsToProcess);
-                
-                // Hide buttons, show progress
-                document.getElementById('singleBtn').style.display = 'none';
-                document.getElementById('multiBtn').style.display = 'none';
-                document.getElementById('progressSection').style.display = 'block';
-                document.getElementById('successSection').style.display = 'none';
-                
-                try {{
-                    // Start generation process
-                    updateProgress(10, 'Starting multi-month email collection...');
-                    
-                    const response = await fetch('/api/start-generation', {{
-                        method: 'POST',
-                        headers: {{'Content-Type': 'application/json'}},
-                        body: JSON.stringify({{
-                            month: parseInt(month), 
-                            year: parseInt(year),
-                            mode: 'multi'
-                        }})
-                    }});
-                    
-                    if (!response.ok) {{
-                        throw new Error('Failed to start generation');
-                    }}
-                    
-                    const data = await response.json();
-                    generationId = data.generation_id;
-                    
-                    // Start polling for progress
-                    startProgressPolling();
-                    
-                }} catch (error) {{
-                    showError('Failed to start generation: ' + error.message);
-                }}
-            }}
-            
-            let downloadedFiles = new Set();
-            
-            function startProgressPolling() {{
-                progressInterval = setInterval(async () => {{
-                    try {{
-                        const response = await fetch(`/api/generation-status/${{generationId}}`);
-                        const status = await response.json();
-                        
-                        updateProgress(status.progress, status.message);
-                        
-                        // Handle downloads based on mode
-                        if (status.mode === 'single') {{
-                            // Single file download when complete
-                            if (status.status === 'completed' && status.completed_files && status.completed_files.length > 0) {{
-                                clearInterval(progressInterval);
-                                showSuccess(1, status.total_email_count);
-                                // Auto-download the single file
-                                setTimeout(() => {{
-                                    downloadFile(0, status.completed_files[0].filename);
-                                }}, 500);
-                            }}
-                        }} else {{
-                            // Multi-month mode - single combined file when complete
-                            if (status.status === 'completed' && status.completed_files && status.completed_files.length > 0) {{
-                                clearInterval(progressInterval);
-                                showSuccess(1, status.total_email_count);
-                                // Auto-download the combined file
-                                setTimeout(() => {{
-                                    downloadFile(0, status.completed_files[0].filename);
-                                }}, 500);
-                            }}
-                        }}
-                        
-                        if (status.status === 'completed' && (!status.completed_files || status.completed_files.length === 0)) {{
-                            clearInterval(progressInterval);
-                            showSuccess(0, 0);
-                        }} else if (status.status === 'failed') {{
-                            clearInterval(progressInterval);
-                            showError(status.message);
-                        }}
-                    }} catch (error) {{
-                        console.error('Error polling status:', error);
-                    }}
-                }}, 1000); // Poll every second
-            }}
-            
-            function downloadFile(fileIndex, filename) {{
-                console.log(`Auto-downloading: ${{filename}}`);
-                window.location.href = `/api/download/${{generationId}}?file_index=${{fileIndex}}`;
-            }}
-            
-            function updateProgress(percent, message) {{
-                document.getElementById('progressBar').style.width = percent + '%';
-                document.getElementById('progressText').textContent = Math.round(percent) + '%';
-                document.getElementById('statusText').textContent = message;
-            }}
-            
-            function showSuccess(fileCount, totalEmailCount) {{
-                document.getElementById('progressSection').style.display = 'none';
-                document.getElementById('successSection').style.display = 'block';
-                document.getElementById('successMessage').textContent = 
-                    `Successfully processed ${{totalEmailCount}} emails in ${{fileCount}} CSV file. File has been automatically downloaded.`;
-                
-                // Hide download button since files are auto-downloaded
-                document.getElementById('downloadBtn').style.display = 'none';
-            }}
-            
-            function showError(message) {{
-                document.getElementById('progressSection').style.display = 'none';
-                document.getElementById('singleBtn').style.display = 'block';
-                document.getElementById('multiBtn').style.display = 'block';
-                alert('Error: ' + message);
-            }}
-            
-            function resetForm() {{
-                document.getElementById('successSection').style.display = 'none';
-                document.getElementById('singleBtn').style.display = 'block';
-                document.getElementById('multiBtn').style.display = 'block';
-                generationId = null;
-            }}
-            
-            function cancelGeneration() {{
-                if (progressInterval) {{
-                    clearInterval(progressInterval);
-                }}
-                // TODO: Send cancel request to server
-                resetForm();
-            }}
-        </script>
+        <script src="/static/dashboard.js?v=__DASHBOARD_JS_VERSION__"></script>
     </body>
     </html>
-    """)
+    """
+DASHBOARD_HTML_HEAD, DASHBOARD_HTML_TAIL = DASHBOARD_HTML.replace("__DASHBOARD_JS_VERSION__", DASHBOARD_JS_VERSION).split("__USER_EMAIL__")
+
+@app.get("/static/dashboard.js")
+async def dashboard_js():
+    # Versioned URL, so the browser may cache it for good
+    return Response(
+        content=DASHBOARD_JS_BYTES,
+        media_type="application/javascript",
+        headers={"Cache-Control": STATIC_CACHE_CONTROL, "ETag": f'"{DASHBOARD_JS_VERSION}"'}
+    )
+
+@app.get("/dashboard", response_class=HTMLResponse)
+async def dashboard(request: Request):
+    session_id = request.cookies.get("session_id")
+    if not session_id or session_id not in user_sessions:
+        return RedirectResponse(url="/")
+    
+    user_email = html.escape(user_sessions[session_id]['email'])
+    
+    return HTMLResponse(
+        content=DASHBOARD_HTML_HEAD + user_email + DASHBOARD_HTML_TAIL,
+        headers={"Cache-Control": "private, no-cache"}
+    )
 
 @app.post("/api/start-generation")
 async def start_generation(request: Request):
@@ -489,61 +693,111 @@ async def start_generation(request: Request):
     
     try:
         data = await request.json()
-        month = data['month']
-        year = data['year']
         mode = data.get('mode', 'multi')  # Default to multi for backward compatibility
+        start_date, end_date, file_label = resolve_date_range(data, mode)
         
-        # Generate unique ID for this generation task
-        generation_id = secrets.token_urlsafe(16)
-        
-        # Calculate months to process based on mode
-        if mode == 'single':
-            # Single month only
-            months_to_process = [{
-                'month': month,
-                'year': year,
-                'name': calendar.month_name[month]
-            }]
-        else:
-            # Multiple months from start to July 2025
-            start_date = datetime(year, month, 1)
-            end_date = datetime(2025, 7, 31)  # July 2025
-            months_to_process = []
-            
-            current_month = start_date
-            while current_month <= end_date:
-                months_to_process.append({
-                    'month': current_month.month,
-                    'year': current_month.year,
-                    'name': calendar.month_name[current_month.month]
-                })
-                if current_month.month == 12:
-                    current_month = current_month.replace(year=current_month.year + 1, month=1)
-                else:
-                    current_month = current_month.replace(month=current_month.month + 1)
-        
-        # Initialize status
-        generation_status[generation_id] = {
-            'status': 'processing',
-            'progress': 0,
-            'message': 'Starting...',
-            'session_id': session_id,
-            'months_to_process': months_to_process,
-            'current_month_index': 0,
-            'completed_files': [],
-            'total_email_count': 0,
-            'mode': mode
-        }
+        tz_name = data.get('timezone') or DEFAULT_TIMEZONE
+        date_format = data.get('date_format') or DEFAULT_DATE_FORMAT
+        profiled = str(data.get('profile', request.query_params.get('profile', ''))).lower() in ('true', '1')
+        
+        # Validates the timezone name and format before any work starts
+        get_sent_date_formatter(tz_name, date_format)
+        
+        # Attach to an identical in-flight job, or reuse a fresh finished one
+        request_key = (user_sessions[session_id]['email'].lower(), mode, start_date, end_date, tz_name, date_format, profiled)
+        existing_id = generation_index.get(request_key)
+        if existing_id in generation_status:
+            existing = generation_status[existing_id]
+            if existing['status'] == 'processing':
+                print(f"Attaching request to in-flight generation {existing_id}")
+                return {"generation_id": existing_id, "status": "attached"}
+            if existing['status'] == 'completed' and not existing['fetch_errors'] and await is_generation_result_fresh(existing, user_sessions[session_id]):
+                print(f"Reusing completed generation {existing_id}")
+                return {"generation_id": existing_id, "status": "cached"}
+        
+        generation_id = create_generation(
+            user_sessions[session_id], mode, start_date, end_date, file_label,
+            tz_name=tz_name, date_format=date_format, profiled=profiled, session_id=session_id
+        )
+        generation_index[request_key] = generation_id
         
         # Start background task (we'll implement this next)
         asyncio.create_task(process_emails_background(generation_id))
         
         return {"generation_id": generation_id, "status": "started"}
         
+    except (KeyError, ValueError) as e:
+        print(f"Invalid generation request: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error starting generation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def create_generation(user_data, mode, start_date, end_date, file_label, tz_name=DEFAULT_TIMEZONE,
+                      date_format=DEFAULT_DATE_FORMAT, output_format='csv', profiled=False, session_id=None):
+    """Register a new generation and return its ID (the caller starts the background task)"""
+    # Generate unique ID for this generation task
+    generation_id = secrets.token_urlsafe(16)
+    
+    # Initialize status; query windows are planned once the Gmail service is up
+    generation_status[generation_id] = {
+        'status': 'processing',
+        'progress': 0,
+        'message': 'Starting...',
+        'session_id': session_id,
+        'user': user_data,
+        'start_date': start_date,
+        'end_date': end_date,
+        'file_label': file_label,
+        'windows': [],
+        'current_window_index': 0,
+        'completed_files': [],
+        'total_email_count': 0,
+        'fetch_errors': [],
+        'aggregates': new_aggregates(),
+        'profile': JobProfile() if profiled else None,
+        'quota_flow': quota_scheduler.register(generation_id, SCHEDULER_WEIGHTS.get(mode, 1)),
+        'timezone': tz_name,
+        'date_format': date_format,
+        'output_format': output_format,
+        'history_id': None,
+        'completed_at': None,
+        'mode': mode
+    }
+    return generation_id
+
+async def is_generation_result_fresh(status, user_data):
+    """A completed result is reusable within RESULT_CACHE_TTL if no mail was sent since it started"""
+    if status['completed_at'] is None or time.time() - status['completed_at'] > RESULT_CACHE_TTL:
+        return False
+    if status['history_id'] is None:
+        return False
+    
+    # Charge the check to the request, not to the finished job's (unregistered) flow
+    flow = quota_scheduler.register(f"freshness-{secrets.token_urlsafe(8)}", SCHEDULER_WEIGHTS.get(status['mode'], 1))
+    try:
+        await quota_scheduler.acquire(flow, GMAIL_QUOTA_COST['history'])
+        # Credential refresh and the history round trip are blocking
+        return not await asyncio.to_thread(has_sent_mail_since, user_data, status['history_id'])
+    except Exception as e:
+        # Unknown or expired historyId - treat the result as stale
+        print(f"Could not check mailbox history: {e}")
+        return False
+    finally:
+        quota_scheduler.unregister(flow)
+
+def has_sent_mail_since(user_data, history_id):
+    """Whether Gmail history shows sent mail added after history_id"""
+    service = build_gmail_service(credentials_from_data(user_data['credentials']))
+    history = service.users().history().list(
+        userId='me',
+        startHistoryId=history_id,
+        labelId='SENT',
+        historyTypes='messageAdded',
+        maxResults=1
+    ).execute()
+    return bool(history.get('history'))
+
 @app.get("/api/generation-status/{generation_id}")
 async def get_generation_status(generation_id: str):
     """Get the current status of email generation"""
@@ -557,15 +811,103 @@ async def get_generation_status(generation_id: str):
         "message": status['message'],
         "completed_files": status.get('completed_files', []),
         "total_email_count": status.get('total_email_count', 0),
-        "current_month_index": status.get('current_month_index', 0),
-        "months_to_process": status.get('months_to_process', []),
-        "mode": status.get('mode', 'multi')
+        "fetch_errors": status['fetch_errors'],
+        "start_date": status['start_date'].isoformat(),
+        "end_date": (status['end_date'] - timedelta(days=1)).isoformat(),
+        "current_window_index": status.get('current_window_index', 0),
+        "windows": [serialize_window(w) for w in status.get('windows', [])],
+        "mode": status.get('mode', 'multi'),
+        "profile_available": status.get('profile') is not None,
+        **quota_scheduler.flow_status(status['quota_flow']),
+        **progress_report(status)
     }
 
+@app.get("/api/summary/{generation_id}")
+async def get_generation_summary(generation_id: str, limit: int = 100, offset: int = 0):
+    """Recipient and thread aggregates for a generation (available while processing)"""
+    if generation_id not in generation_status:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    
+    status = generation_status[generation_id]
+    aggregates = status['aggregates']
+    formatter = get_sent_date_formatter(status['timezone'], status['date_format'])
+    offset = max(offset, 0)
+    limit = max(1, min(limit, QUERY_MAX_LIMIT))
+    
+    # Only the requested page is built and date formatted
+    return {
+        "status": status['status'],
+        "total_email_count": sum(r['message_count'] for r in aggregates['recipients'].values()),
+        "recipient_count": len(aggregates['recipients']),
+        "thread_count": len(aggregates['threads']),
+        "recipients": recipient_summary_rows(aggregates, formatter, offset, limit),
+        "threads": thread_summary_rows(aggregates, formatter, offset, limit)
+    }
+
+@app.get("/api/query")
+def query_records(
+    request: Request,
+    recipient: str = None,
+    thread_id: str = None,
+    start_date: str = None,
+    end_date: str = None,
+    limit: int = 100,
+    cursor: str = None,
+    count: bool = True,
+    tz_name: str = Query(DEFAULT_TIMEZONE, alias="timezone"),
+    date_format: str = DEFAULT_DATE_FORMAT
+):
+    """Query previously exported records for the signed-in account without touching Gmail.
+    
+    A plain def so FastAPI runs the SQLite work in its threadpool.
+    """
+    session_id = request.cookies.get("session_id")
+    if not session_id or session_id not in user_sessions:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    try:
+        result = query_email_records(
+            user_sessions[session_id]['email'],
+            get_sent_date_formatter(tz_name, date_format),
+            recipient=recipient,
+            thread_id=thread_id,
+            start_date=date.fromisoformat(start_date) if start_date else None,
+            end_date=date.fromisoformat(end_date) if end_date else None,
+            limit=max(1, min(limit, QUERY_MAX_LIMIT)),
+            cursor=cursor,
+            include_count=count
+        )
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return result
+
+@app.get("/api/profile/{generation_id}")
+async def get_generation_profile(generation_id: str, format: str = 'json'):
+    """Phase breakdown (json) or flamegraph collapsed stacks (collapsed) for a profiled job"""
+    if generation_id not in generation_status:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    
+    profile = generation_status[generation_id].get('profile')
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profiling was not enabled for this generation")
+    
+    if format == 'collapsed':
+        return Response(
+            content=profile.collapsed_stacks(),
+            media_type="text/plain",
+            headers={"Content-Disposition": f"attachment; filename={generation_id}.folded"}
+        )
+    
+    return profile.report()
+
 @app.get("/api/download/{generation_id}")
-async def download_csv(generation_id: str, file_index: int = 0):
-    """Download a specific CSV file"""
+def download_csv(generation_id: str, file_index: int = 0):
+    """Download a specific CSV file (a plain def: S3 lookups run in FastAPI's threadpool)"""
     if generation_id not in generation_status:
+        if EXPORT_S3_BUCKET:
+            # Produced by another replica (or before a restart) - serve it from the store
+            return s3_download_response(export_object_key(generation_id, file_index), check_exists=True)
         raise HTTPException(status_code=404, detail="Generation not found")
     
     status = generation_status[generation_id]
@@ -579,156 +921,591 @@ async def download_csv(generation_id: str, file_index: int = 0):
     
     file_info = completed_files[file_index]
     
+    if 's3_key' in file_info:
+        return s3_download_response(file_info['s3_key'])
+    
     return StreamingResponse(
         io.StringIO(file_info['csv_content']),
-        media_type="text/csv",
+        media_type=file_info.get('media_type', "text/csv"),
         headers={"Content-Disposition": f"attachment; filename={file_info['filename']}"}
     )
 
+class QuotaScheduler:
+    """Weighted fair queueing of Gmail quota units across active generations.
+    
+    Quota refills as a token bucket at GMAIL_QUOTA_UNITS_PER_SECOND. While
+    there are enough tokens requests go straight through; otherwise they are
+    queued and granted in order of virtual finish time, so a job's share of
+    the quota under contention is proportional to its weight.
+    """
+    
+    def __init__(self, units_per_second, burst):
+        self.units_per_second = units_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.virtual_time = 0.0
+        self.queue = []  # heap of (finish_tag, seq, flow, units, future)
+        self.flows = {}
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self.daily_used = 0
+        self.daily_date = None
+    
+    def register(self, generation_id, weight):
+        flow = {'generation_id': generation_id, 'weight': weight, 'last_finish': 0.0, 'units_used': 0, 'calls': {}}
+        self.flows[generation_id] = flow
+        return flow
+    
+    def unregister(self, flow):
+        self.flows.pop(flow['generation_id'], None)
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.units_per_second)
+        self.updated = now
+    
+    async def acquire(self, flow, units):
+        start_tag = max(self.virtual_time, flow['last_finish'])
+        finish_tag = start_tag + units / flow['weight']
+        flow['last_finish'] = finish_tag
+        flow['units_used'] += units
+        
+        today = datetime.now(QUOTA_RESET_TZ).date()
+        if today != self.daily_date:
+            self.daily_date = today
+            self.daily_used = 0
+        self.daily_used += units
+        
+        self._refill()
+        if not self.queue and self.tokens >= units:
+            self.tokens -= units
+            self.virtual_time = start_tag
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (finish_tag, next(self._seq), flow, units, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+    
+    async def _dispatch(self):
+        while self.queue:
+            finish_tag, _, flow, units, future = self.queue[0]
+            if future.cancelled():
+                heapq.heappop(self.queue)
+                continue
+            self._refill()
+            if self.tokens < units:
+                await asyncio.sleep((units - self.tokens) / self.units_per_second)
+                continue
+            heapq.heappop(self.queue)
+            self.tokens -= units
+            self.virtual_time = finish_tag - units / flow['weight']
+            future.set_result(None)
+    
+    def flow_status(self, flow):
+        """Queue position (1 = next) and expected wait for a flow's next request"""
+        pending = [entry for entry in self.queue if entry[2] is flow]
+        if not pending:
+            return {'queue_position': 0, 'expected_wait_seconds': 0.0, 'quota_units_used': flow['units_used']}
+        
+        head = min(pending)
+        ahead = [entry for entry in self.queue if entry < head]
+        units_ahead = sum(entry[3] for entry in ahead) + head[3]
+        self._refill()
+        return {
+            'queue_position': len({id(entry[2]) for entry in ahead}) + 1,
+            'expected_wait_seconds': round(max(0.0, units_ahead - self.tokens) / self.units_per_second, 2),
+            'quota_units_used': flow['units_used']
+        }
+
+    def share_per_second(self, flow):
+        """Units/second this flow gets when every active flow is contending"""
+        total_weight = flow['weight'] + sum(f['weight'] for f in self.flows.values() if f is not flow)
+        return self.units_per_second * flow['weight'] / total_weight
+    
+    def daily_status(self):
+        """Remaining daily units (if GMAIL_DAILY_QUOTA_UNITS is set) and the next reset"""
+        now = datetime.now(QUOTA_RESET_TZ)
+        used = self.daily_used if self.daily_date == now.date() else 0
+        reset_at = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), QUOTA_RESET_TZ)
+        return {
+            'quota_units_remaining_today': max(GMAIL_DAILY_QUOTA_UNITS - used, 0) if GMAIL_DAILY_QUOTA_UNITS else None,
+            'quota_reset_at': reset_at.isoformat()
+        }
+
+quota_scheduler = QuotaScheduler(GMAIL_QUOTA_UNITS_PER_SECOND, GMAIL_QUOTA_BURST)
+
+def start_progress_tracking(status):
+    """Begin measuring fetch throughput once the windows are planned"""
+    status['expected_messages'] = sum(w['estimate'] for w in status['windows'])
+    status['processed_messages'] = 0
+    status['throughput'] = None
+    status['throughput_sampled_at'] = time.monotonic()
+    status['throughput_sampled_count'] = 0
+    status['progress'] = FETCH_PROGRESS_START
+
+def current_throughput(status, now):
+    """EWMA throughput including the open sample, so stalls decay the rate.
+    
+    The open sample counts as one sample per THROUGHPUT_SAMPLE_SECONDS it
+    spans: a long rate limit or queue wait pulls the rate towards zero
+    instead of leaving the last value frozen.
+    """
+    elapsed = now - status['throughput_sampled_at']
+    previous = status['throughput']
+    if elapsed < THROUGHPUT_SAMPLE_SECONDS:
+        return previous
+    rate = (status['processed_messages'] - status['throughput_sampled_count']) / elapsed
+    if previous is None:
+        return rate
+    keep = (1 - THROUGHPUT_EWMA_ALPHA) ** (elapsed / THROUGHPUT_SAMPLE_SECONDS)
+    return keep * previous + (1 - keep) * rate
+
+def update_progress(status, processed=0):
+    """Advance processed messages, the EWMA throughput and the progress percentage"""
+    status['processed_messages'] += processed
+    
+    now = time.monotonic()
+    if now - status['throughput_sampled_at'] >= THROUGHPUT_SAMPLE_SECONDS:
+        status['throughput'] = current_throughput(status, now)
+        status['throughput_sampled_at'] = now
+        status['throughput_sampled_count'] = status['processed_messages']
+    
+    expected = max(status['expected_messages'], status['processed_messages'])
+    done = status['processed_messages'] / expected if expected else 0
+    status['progress'] = FETCH_PROGRESS_START + (FETCH_PROGRESS_END - FETCH_PROGRESS_START) * done
+
+def progress_report(status):
+    """Expected work, throughput, ETA and quota figures for the status API"""
+    flow = status['quota_flow']
+    report = {
+        'expected_messages': status.get('expected_messages'),
+        'processed_messages': status.get('processed_messages', 0),
+        'throughput_messages_per_second': None,
+        'eta_seconds': None,
+        'quota_units_needed': None,
+        'quota_units_per_second': None,
+        **quota_scheduler.daily_status()
+    }
+    if status['status'] != 'processing':
+        return report
+    
+    share = quota_scheduler.share_per_second(flow)
+    report['quota_units_per_second'] = round(share, 1)
+    if status.get('expected_messages') is None:
+        return report
+    
+    remaining = max(status['expected_messages'] - status['processed_messages'], 0)
+    units_needed = remaining * GMAIL_QUOTA_COST['get']
+    report['quota_units_needed'] = units_needed
+    
+    throughput = current_throughput(status, time.monotonic())
+    if throughput is not None:
+        report['throughput_messages_per_second'] = round(throughput, 2)
+    if report['throughput_messages_per_second']:
+        # Stalled jobs (rate decayed to zero) have no ETA; never faster than this job's share of the project quota allows
+        report['eta_seconds'] = round(max(remaining / throughput, units_needed / share), 1)
+    return report
+
+async def acquire_quota(status, method):
+    """Wait for this generation's turn to spend quota on a Gmail call"""
+    flow = status.get('quota_flow')
+    if flow is not None:
+        flow['calls'][method] = flow['calls'].get(method, 0) + 1
+        await quota_scheduler.acquire(flow, GMAIL_QUOTA_COST[method])
+
+async def run_blocking(status, call, *args):
+    """Run a blocking call (Gmail, SQLite, S3) in a worker thread, sampled when the job is profiled"""
+    profile = status.get('profile')
+    if profile is not None:
+        return await asyncio.to_thread(profile.run_in_worker, call, *args)
+    return await asyncio.to_thread(call, *args)
+
+NULL_PHASE = nullcontext()
+
+# Accumulator of the innermost open phase in this task or worker thread
+PROFILE_PARENT_PHASE = contextvars.ContextVar('profile_parent_phase', default=None)
+
+def profile_phase(profile, name):
+    """Time a phase when the job is profiled; a shared no-op otherwise"""
+    return profile.phase(name) if profile is not None else NULL_PHASE
+
+class JobProfile:
+    """Per-phase timers plus a sampling profiler for a single generation.
+    
+    Phase times are exclusive: a phase nested in another (e.g. json_decode
+    inside gmail_get) is subtracted from its parent. Nesting is tracked per
+    task and worker thread, so concurrent windows are timed independently and
+    phase totals are summed across them. Samples are kept while one of the
+    job's coroutines is on the event loop thread's stack, and for worker
+    threads while they run one of the job's blocking calls.
+    """
+    
+    def __init__(self):
+        self.phases = {}  # name -> [exclusive seconds, calls]
+        self.samples = {}  # collapsed stack -> count
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+        self._target_frames = set()  # job coroutine frames on the event loop thread
+        self._workers = {}  # worker thread ident -> running calls
+        self._stop = threading.Event()
+        self._sampler = None
+    
+    @contextmanager
+    def phase(self, name):
+        parent = PROFILE_PARENT_PHASE.get()
+        child_time = [0.0]
+        token = PROFILE_PARENT_PHASE.set(child_time)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            PROFILE_PARENT_PHASE.reset(token)
+            if parent is not None:
+                parent[0] += elapsed
+            with self._lock:
+                entry = self.phases.setdefault(name, [0.0, 0])
+                entry[0] += elapsed - child_time[0]
+                entry[1] += 1
+    
+    @contextmanager
+    def sampling_frame(self, frame):
+        """Sample the event loop thread while frame (one of the job's coroutines) is running"""
+        self._target_frames.add(frame)
+        try:
+            yield
+        finally:
+            self._target_frames.discard(frame)
+    
+    def run_in_worker(self, call, *args):
+        """Run call in the current worker thread, sampling it meanwhile"""
+        ident = threading.get_ident()
+        with self._lock:
+            self._workers[ident] = self._workers.get(ident, 0) + 1
+        try:
+            return call(*args)
+        finally:
+            with self._lock:
+                self._workers[ident] -= 1
+                if not self._workers[ident]:
+                    del self._workers[ident]
+    
+    def start_sampling(self, target_frame):
+        """Start sampling; target_frame is the job coroutine on the event loop thread"""
+        self._target_frames.add(target_frame)
+        self._sampler = threading.Thread(
+            target=self._sample_loop,
+            args=(threading.get_ident(),),
+            name="job-profiler",
+            daemon=True
+        )
+        self._sampler.start()
+    
+    def stop(self):
+        self.finished = time.perf_counter()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+    
+    def _record_sample(self, frame, is_root):
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            if is_root(frame):
+                break
+            frame = frame.f_back
+        else:
+            return  # Busy with something else (or idle)
+        key = ';'.join(
+            f"{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)}:{f.f_code.co_firstlineno})"
+            for f in reversed(stack)
+        )
+        self.samples[key] = self.samples.get(key, 0) + 1
+    
+    def _sample_loop(self, loop_thread_id):
+        worker_root = JobProfile.run_in_worker.__code__
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with self._lock:
+                workers = list(self._workers)
+            self._record_sample(frames.get(loop_thread_id), lambda f: f in self._target_frames)
+            for ident in workers:
+                self._record_sample(frames.get(ident), lambda f: f.f_code is worker_root)
+    
+    def collapsed_stacks(self):
+        """Brendan Gregg collapsed format, one "frame;frame;frame count" per line"""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
+    
+    def report(self):
+        wall_seconds = (self.finished or time.perf_counter()) - self.started
+        phases = [
+            {
+                'phase': name,
+                'seconds': round(seconds, 4),
+                'calls': calls,
+                'percent': round(100 * seconds / wall_seconds, 1) if wall_seconds else 0
+            }
+            for name, (seconds, calls) in sorted(self.phases.items(), key=lambda item: -item[1][0])
+        ]
+        return {
+            'running': self.finished is None,
+            'wall_seconds': round(wall_seconds, 4),
+            # Concurrent windows make phase totals exceed wall time; clamp rather than go negative
+            'unaccounted_seconds': round(max(wall_seconds - sum(seconds for seconds, _ in self.phases.values()), 0.0), 4),
+            'phases': phases,
+            'sample_count': sum(self.samples.values()),
+            'sample_interval_ms': PROFILE_SAMPLE_INTERVAL * 1000
+        }
+
+def load_stored_credentials(path):
+    """Stored credentials by account email, in the same shape as a web session's"""
+    with open(path) as f:
+        stored = json.load(f)
+    for creds_data in stored.values():
+        # The client secret comes from the environment, not the token file
+        creds_data.setdefault('client_id', GOOGLE_CLIENT_ID)
+        creds_data.setdefault('client_secret', GOOGLE_CLIENT_SECRET)
+        creds_data.setdefault('token', None)
+    return stored
+
+@contextmanager
+def token_store_lock(path):
+    """Exclusive lock across processes while the token store is read and rewritten (POSIX only)"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def save_stored_credentials(path, user_email, credentials):
+    """Add or replace an account's refresh token in the token store"""
+    try:
+        with token_store_lock(path):
+            stored = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    stored = json.load(f)
+            stored[user_email] = {
+                'refresh_token': credentials.refresh_token,
+                'token_uri': credentials.token_uri,
+                'scopes': credentials.scopes
+            }
+            
+            # Write a private temp file and swap it in, so a crash mid-write never
+            # leaves a truncated store and an older file's permissions don't survive
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tokens-')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(stored, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(temp_path, 0o600)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+    except (OSError, ValueError) as e:
+        print(f"Could not save stored credentials for {user_email}: {e}")
+
+def credentials_from_data(creds_data):
+    """Recreate Google credentials from a stored session, refreshing if expired"""
+    from google.auth.transport.requests import Request as GoogleRequest
+    from google.oauth2.credentials import Credentials
+    
+    credentials = Credentials(
+        token=creds_data['token'],
+        refresh_token=creds_data['refresh_token'],
+        token_uri=creds_data['token_uri'],
+        client_id=creds_data['client_id'],
+        client_secret=creds_data['client_secret'],
+        scopes=creds_data['scopes']
+    )
+    
+    # Refresh if needed (stored tokens start without an access token)
+    if (credentials.expired or not credentials.token) and credentials.refresh_token:
+        credentials.refresh(GoogleRequest())
+    
+    return credentials
+
 async def process_emails_background(generation_id: str):
     """Background task to process emails for multiple months"""
+    status = generation_status[generation_id]
+    profile = status.get('profile')
+    if profile is not None:
+        profile.start_sampling(sys._getframe())
+    
     try:
-        status = generation_status[generation_id]
-        session_id = status['session_id']
-        months_to_process = status['months_to_process']
-        total_months = len(months_to_process)
-        
         # Update progress
-        status['progress'] = 10
+        status['progress'] = 1
         status['message'] = 'Authenticating with Gmail...'
         
-        # Get user session
-        user_data = user_sessions[session_id]
+        # Account the job runs for (a web session or a stored token)
+        user_data = status['user']
         creds_data = user_data['credentials']
         
-        # Recreate credentials
-        credentials = Credentials(
-            token=creds_data['token'],
-            refresh_token=creds_data['refresh_token'],
-            token_uri=creds_data['token_uri'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
-            scopes=creds_data['scopes']
-        )
+        with profile_phase(profile, 'auth'):
+            # Recreate (and refresh if needed) credentials
+            credentials = credentials_from_data(creds_data)
+            
+            # Build Gmail service
+            status['progress'] = 2
+            status['message'] = 'Connecting to Gmail API...'
+            service = build_gmail_service(credentials)
+            
+            # Test connection
+            await acquire_quota(status, 'getProfile')
+            gmail_profile = await run_blocking(status, service.users().getProfile(userId='me').execute)
+            print(f"Connected to Gmail for: {gmail_profile['emailAddress']}")
+            # Mail sent after this point invalidates the memoized result
+            status['history_id'] = gmail_profile.get('historyId')
         
-        # Refresh if needed
-        if credentials.expired and credentials.refresh_token:
-            status['message'] = 'Refreshing credentials...'
-            credentials.refresh(GoogleRequest())
+        # Plan evenly sized query windows for the requested range
+        status['progress'] = 3
+        status['message'] = 'Planning query windows...'
+        with profile_phase(profile, 'planning'):
+            windows = await plan_query_windows(service, status['start_date'], status['end_date'], status)
+        status['windows'] = windows
+        start_progress_tracking(status)
+        print(f"Planned {len(windows)} query windows (~{status['expected_messages']} messages)")
         
-        # Build Gmail service
-        status['progress'] = 15
-        status['message'] = 'Connecting to Gmail API...'
-        service = build('gmail', 'v1', credentials=credentials)
+        # Fetch windows concurrently, each worker with its own Gmail service
+        # (httplib2 is not thread-safe)
+        workers = max(1, min(WINDOW_FETCH_CONCURRENCY, len(windows)))
+        idle_services = asyncio.Queue()
+        idle_services.put_nowait(service)
+        for _ in range(workers - 1):
+            idle_services.put_nowait(build_gmail_service(credentials))
         
-        # Test connection
-        profile = service.users().getProfile(userId='me').execute()
-        print(f"Connected to Gmail for: {profile['emailAddress']}")
+        async def fetch_window(window_index, window):
+            worker_service = await idle_services.get()
+            try:
+                status['message'] = f"Processing {window['label']}..."
+                status['current_window_index'] = window_index
+                print(f"Processing emails for {window['label']}")
+                # Window tasks don't run under the job coroutine's frame, so sample them too
+                sampling = profile.sampling_frame(sys._getframe()) if profile is not None else NULL_PHASE
+                with sampling:
+                    return await process_date_range(worker_service, window, status)
+            finally:
+                idle_services.put_nowait(worker_service)
         
-        mode = status.get('mode', 'multi')
+        # Combine every window into a single file
+        all_emails = []
+        window_results = await asyncio.gather(*(fetch_window(i, w) for i, w in enumerate(windows)))
         
-        if mode == 'single':
-            # Single month processing
-            month_info = months_to_process[0]
-            current_month = month_info['month']
-            current_year = month_info['year']
-            month_name = month_info['name']
-            
-            status['progress'] = 20
-            status['message'] = f'Processing {month_name} {current_year}...'
-            
-            print(f"Processing emails for {current_month}/{current_year}")
-            
-            # Process this month
-            month_emails = await process_single_month(service, current_month, current_year, status, 20)
-            
-            if month_emails:
-                # Create CSV for this month
-                csv_content = create_csv_content(month_emails)
-                filename = f"{user_data['email'].split('@')[0]}_{month_name.lower()}_{current_year}.csv"
-                
-                # Store completed file
-                file_info = {
-                    'filename': filename,
-                    'csv_content': csv_content,
-                    'email_count': len(month_emails),
-                    'month': current_month,
-                    'year': current_year,
-                    'month_name': month_name
-                }
-                status['completed_files'].append(file_info)
-                status['total_email_count'] = len(month_emails)
-                
-                print(f"Completed {month_name} {current_year}: {len(month_emails)} emails")
+        for window, window_emails in zip(windows, window_results):
+            if window_emails:
+                all_emails.extend(window_emails)
+                with profile_phase(profile, 'store'):
+                    await run_blocking(status, store_email_records, user_data['email'], generation_id, window_emails)
+                print(f"Completed {window['label']}: {len(window_emails)} emails")
+            else:
+                print(f"No emails found for {window['label']}")
+        
+        status['progress'] = FETCH_PROGRESS_END
+        status['message'] = 'Writing export files...'
+        
+        if all_emails:
+            formatter = get_sent_date_formatter(status['timezone'], status['date_format'])
+            filename = f"{user_data['email'].split('@')[0]}_{status['file_label']}.csv"
             
-        else:
-            # Multi-month processing - combine all emails into single file
-            all_emails = []
+            if status['output_format'] == 'jsonl':
+                with profile_phase(profile, 'jsonl_writer'):
+                    file_info = await run_blocking(
+                        status, write_export_file, generation_id, 0, filename.replace('.csv', '.jsonl'), 'application/x-ndjson',
+                        lambda output: write_jsonl(all_emails, formatter, output)
+                    )
+            else:
+                with profile_phase(profile, 'csv_writer'):
+                    file_info = await run_blocking(
+                        status, write_export_file, generation_id, 0, filename, 'text/csv',
+                        lambda output: write_csv(all_emails, formatter, output)
+                    )
+            file_info['email_count'] = len(all_emails)
+            file_info['windows_included'] = len(windows)
+            status['completed_files'].append(file_info)
+            status['total_email_count'] = len(all_emails)
             
-            for month_index, month_info in enumerate(months_to_process):
-                current_month = month_info['month']
-                current_year = month_info['year']
-                month_name = month_info['name']
-                
-                # Update progress for current month
-                base_progress = 20 + (month_index / total_months) * 70
-                status['progress'] = base_progress
-                status['message'] = f'Processing {month_name} {current_year}...'
-                status['current_month_index'] = month_index
-                
-                print(f"Processing emails for {current_month}/{current_year}")
-                
-                # Process this month
-                month_emails = await process_single_month(service, current_month, current_year, status, base_progress)
-                
-                if month_emails:
-                    all_emails.extend(month_emails)
-                    print(f"Completed {month_name} {current_year}: {len(month_emails)} emails")
-                else:
-                    print(f"No emails found for {month_name} {current_year}")
+            print(f"Created {status['output_format'].upper()} with {len(all_emails)} emails from {len(windows)} query windows")
             
-            # Create single combined CSV file
-            if all_emails:
-                csv_content = create_csv_content(all_emails)
-                start_month = calendar.month_name[months_to_process[0]['month']].lower()
-                start_year = months_to_process[0]['year']
-                end_month = calendar.month_name[months_to_process[-1]['month']].lower()
-                end_year = months_to_process[-1]['year']
-                
-                if len(months_to_process) == 1:
-                    filename = f"{user_data['email'].split('@')[0]}_{start_month}_{start_year}.csv"
-                else:
-                    filename = f"{user_data['email'].split('@')[0]}_{start_month}_{start_year}_to_{end_month}_{end_year}.csv"
-                
-                # Store combined file
-                file_info = {
-                    'filename': filename,
-                    'csv_content': csv_content,
-                    'email_count': len(all_emails),
-                    'months_included': len(months_to_process)
-                }
-                status['completed_files'].append(file_info)
-                status['total_email_count'] = len(all_emails)
-                
-                print(f"Created combined CSV with {len(all_emails)} emails from {len(months_to_process)} months")
+            # Summary files from the aggregates collected while parsing
+            aggregates = status['aggregates']
+            with profile_phase(profile, 'summary_writer'):
+                recipients_file = await run_blocking(
+                    status, write_export_file, generation_id, 1, filename.replace('.csv', '_recipients.csv'), 'text/csv',
+                    lambda output: write_summary_csv(recipient_summary_rows(aggregates, formatter), RECIPIENT_SUMMARY_COLUMNS, output)
+                )
+                threads_file = await run_blocking(
+                    status, write_export_file, generation_id, 2, filename.replace('.csv', '_threads.csv'), 'text/csv',
+                    lambda output: write_summary_csv(thread_summary_rows(aggregates, formatter), THREAD_SUMMARY_COLUMNS, output)
+                )
+            status['completed_files'].append({**recipients_file, 'email_count': len(all_emails), 'summary': 'recipients'})
+            status['completed_files'].append({**threads_file, 'email_count': len(all_emails), 'summary': 'threads'})
         
         # Mark as completed
         status['status'] = 'completed'
+        status['completed_at'] = time.time()
         status['progress'] = 100
-        status['message'] = f'Completed! Generated {len(status["completed_files"])} CSV files with {status["total_email_count"]} total emails.'
+        # Summary files ride along with the export; only count the export itself
+        export_files = [f for f in status['completed_files'] if 'summary' not in f]
+        file_type = status['output_format'].upper()
+        status['message'] = f'Completed! Generated {len(export_files)} {file_type} files with {status["total_email_count"]} total emails.'
+        if status['fetch_errors']:
+            status['message'] = (
+                f'Completed with {len(status["fetch_errors"])} fetch errors, some emails may be missing. '
+                f'Generated {len(export_files)} {file_type} files with {status["total_email_count"]} emails.'
+            )
         
-        print(f"Successfully generated {len(status['completed_files'])} CSV files")
+        print(f"Successfully generated {len(export_files)} {file_type} files")
         
     except Exception as e:
         print(f"Background processing error: {e}")
         print(traceback.format_exc())
         status['status'] = 'failed'
         status['message'] = f'Error: {str(e)}'
+    finally:
+        quota_scheduler.unregister(status['quota_flow'])
+        if profile is not None:
+            profile.stop()
 
-def get_email_details(service, message_id):
+def get_email_details(service, message_id, profile=None):
     """Extract email details from message"""
+    from googleapiclient.errors import HttpError
+    
     try:
-        message = service.users().messages().get(userId='me', id=message_id, format='full').execute()
+        with profile_phase(profile, 'gmail_get'):
+            request = service.users().messages().get(userId='me', id=message_id, format='full')
+            if profile is not None:
+                # Split JSON decoding of the full payload out of the round trip
+                decode = request.postproc
+                def timed_decode(resp, content):
+                    with profile.phase('json_decode'):
+                        return decode(resp, content)
+                request.postproc = timed_decode
+            message = request.execute()
+        
+        return parse_email_details(message, message_id, profile)
+        
+    except HttpError:
+        # Rate limits and quota errors are retried or recorded by the caller
+        raise
+    except Exception as e:
+        print(f"Error parsing email {message_id}: {e}")
+        return None
+
+def parse_email_details(message, message_id, profile=None):
+    """Turn a format='full' message into an export record (None to skip)"""
+    with profile_phase(profile, 'header_parse'):
         headers = message['payload'].get('headers', [])
         
         to_header = next((h['value'] for h in headers if h['name'] == 'To'), '')
@@ -754,15 +1531,8 @@ def get_email_details(service, message_id):
             if not internal_date_ms:
                 return None
             
-            # Convert to datetime in UTC
-            dt_utc = datetime.fromtimestamp(int(internal_date_ms) / 1000, tz=timezone.utc)
-            
-            # Convert to IST (UTC + 5:30)
-            ist_tz = timezone(timedelta(hours=5, minutes=30))
-            dt_ist = dt_utc.astimezone(ist_tz)
-            
-            # Format without timezone label (already converted to IST)
-            sent_date = dt_ist.strftime('%d/%m/%Y %H:%M:%S')
+            # Keep the raw epoch; sent_date is formatted in batches at output time
+            sent_timestamp = int(internal_date_ms)
         except Exception as e:
             print(f"Error parsing internalDate for message {message_id}: {e}")
             return None
@@ -776,41 +1546,585 @@ def get_email_details(service, message_id):
         message_id = message.get('id', '')
         
         return {
-            'sent_date': sent_date,
+            'sent_timestamp': sent_timestamp,
             'recipient_name': recipient_name,
             'recipient_email': recipient_email,
             'thread_id': thread_id,
             'message_id': message_id
         }
+
+# strftime directives that depend on more than the local date, UTC offset and H/M/S
+# Directives that are fixed for a local day (and UTC offset); any directive not
+# listed here or in TIME_OF_DAY_DIRECTIVES sends the format to exact strftime
+DATE_ONLY_DIRECTIVES = {
+    '%d', '%m', '%Y', '%y', '%b', '%B', '%a', '%A', '%j', '%z', '%Z', '%%',
+    '%-d', '%-m', '%-Y', '%-y', '%-b', '%-B', '%-a', '%-A', '%-j', '%-z', '%-Z'
+}
+TIME_OF_DAY_DIRECTIVES = {'%H': 0, '%M': 1, '%S': 2, '%-H': 3, '%-M': 4, '%-S': 5}
+TWO_DIGITS = ['%02d' % i for i in range(60)]
+NO_PAD_DIGITS = [str(i) for i in range(60)]
+OFFSET_BUCKET_MS = 15 * 60 * 1000  # Zone transitions since 1970 fall on 15 minute boundaries
+
+class SentDateFormatter:
+    """Formats internalDate timestamps (ms since epoch) in an IANA timezone.
+    
+    UTC offsets are cached per 15 minute bucket and the date part of the output
+    per local day, so a batch only does integer arithmetic and one str.format
+    per row instead of building a datetime for every message.
+    """
+    
+    def __init__(self, tz_name, date_format):
+        self.tz = ZoneInfo(tz_name)
+        self.date_format = date_format
+        self._tokens = re.findall(r'%-?.|[^%]+', date_format)
+        self._fast = ''.join(self._tokens) == date_format and all(
+            token in DATE_ONLY_DIRECTIVES or token in TIME_OF_DAY_DIRECTIVES or not token.startswith('%')
+            for token in self._tokens
+        )
+        self._offsets = {}  # bucket -> UTC offset in ms, None if a transition falls inside
+        self._days = {}  # (local day, offset) -> str.format template for that day
         
-    except Exception as e:
-        print(f"Error parsing email {message_id}: {e}")
-        return None
+        # Validate the format once up front
+        datetime.now(self.tz).strftime(date_format)
+    
+    def _offset(self, sent_timestamp):
+        bucket = sent_timestamp // OFFSET_BUCKET_MS
+        if bucket not in self._offsets:
+            start = datetime.fromtimestamp(bucket * OFFSET_BUCKET_MS / 1000, self.tz).utcoffset()
+            end = datetime.fromtimestamp(((bucket + 1) * OFFSET_BUCKET_MS - 1) / 1000, self.tz).utcoffset()
+            self._offsets[bucket] = int(start.total_seconds() * 1000) if start == end else None
+        return self._offsets[bucket]
+    
+    def _day_template(self, sent_timestamp):
+        local = datetime.fromtimestamp(sent_timestamp / 1000, self.tz)
+        template = []
+        for token in self._tokens:
+            if token in TIME_OF_DAY_DIRECTIVES:
+                template.append('{%d}' % TIME_OF_DAY_DIRECTIVES[token])
+            else:
+                template.append(local.strftime(token).replace('{', '{{').replace('}', '}}'))
+        return ''.join(template)
+    
+    def format(self, sent_timestamp):
+        return self.format_batch([sent_timestamp])[0]
+    
+    def format_batch(self, timestamps):
+        """Format a sequence of timestamps, reusing the offset and day caches"""
+        if not self._fast:
+            tz, date_format = self.tz, self.date_format
+            return [datetime.fromtimestamp(ts / 1000, tz).strftime(date_format) for ts in timestamps]
+        
+        offsets, days, offset_of = self._offsets, self._days, self._offset
+        two, bare = TWO_DIGITS, NO_PAD_DIGITS
+        formatted = []
+        for ts in timestamps:
+            offset = offsets.get(ts // OFFSET_BUCKET_MS, False)
+            if offset is False:
+                offset = offset_of(ts)
+            if offset is None:
+                # Transition inside this bucket - resolve this row exactly
+                formatted.append(datetime.fromtimestamp(ts / 1000, self.tz).strftime(self.date_format))
+                continue
+            day, ms_of_day = divmod(ts + offset, 86400000)
+            template = days.get((day, offset))
+            if template is None:
+                template = days[(day, offset)] = self._day_template(ts)
+            hours, rest = divmod(ms_of_day // 1000, 3600)
+            minutes, seconds = divmod(rest, 60)
+            formatted.append(template.format(two[hours], two[minutes], two[seconds], bare[hours], bare[minutes], bare[seconds]))
+        return formatted
 
-def create_csv_content(emails):
-    """Create CSV content from email list"""
-    output = io.StringIO()
+@lru_cache(maxsize=32)
+def get_sent_date_formatter(tz_name=DEFAULT_TIMEZONE, date_format=DEFAULT_DATE_FORMAT):
+    """Shared formatter per (timezone, format) so caches survive across jobs"""
+    return SentDateFormatter(tz_name, date_format)
+
+def new_aggregates():
+    """Empty recipient/thread aggregates, filled in as rows are parsed"""
+    return {'recipients': {}, 'threads': {}}
+
+def update_aggregates(aggregates, email_data):
+    """Fold a single parsed email record into the running aggregates"""
+    sent_timestamp = email_data['sent_timestamp']
+    thread_id = email_data['thread_id']
+    recipient_key = email_data['recipient_email'].lower()
+    
+    recipient = aggregates['recipients'].get(recipient_key)
+    if recipient is None:
+        recipient = aggregates['recipients'][recipient_key] = {
+            'recipient_email': email_data['recipient_email'],
+            'recipient_name': email_data['recipient_name'],
+            'message_count': 0,
+            'first_sent': sent_timestamp,
+            'last_sent': sent_timestamp,
+            'thread_ids': set()
+        }
+    recipient['message_count'] += 1
+    recipient['thread_ids'].add(thread_id)
+    if sent_timestamp < recipient['first_sent']:
+        recipient['first_sent'] = sent_timestamp
+    if sent_timestamp >= recipient['last_sent']:
+        recipient['last_sent'] = sent_timestamp
+        recipient['recipient_name'] = email_data['recipient_name']
+    
+    thread = aggregates['threads'].get(thread_id)
+    if thread is None:
+        thread = aggregates['threads'][thread_id] = {
+            'thread_id': thread_id,
+            'message_count': 0,
+            'first_sent': sent_timestamp,
+            'last_sent': sent_timestamp,
+            'recipients': set()
+        }
+    thread['message_count'] += 1
+    thread['recipients'].add(recipient_key)
+    if sent_timestamp < thread['first_sent']:
+        thread['first_sent'] = sent_timestamp
+    if sent_timestamp > thread['last_sent']:
+        thread['last_sent'] = sent_timestamp
+
+def top_summary_entries(entries, sort_key, offset, limit):
+    """Sorted aggregate entries, or just one page of them without sorting the rest"""
+    if limit is None:
+        return sorted(entries, key=sort_key)[offset:]
+    if offset + limit > len(entries) // 4:
+        # Deep pages: one full sort beats a large heap
+        return sorted(entries, key=sort_key)[offset:offset + limit]
+    return heapq.nsmallest(offset + limit, entries, key=sort_key)[offset:]
+
+def recipient_summary_rows(aggregates, formatter, offset=0, limit=None):
+    """Per-recipient summary rows, most contacted first"""
+    recipients = top_summary_entries(
+        aggregates['recipients'].values(), lambda r: (-r['message_count'], r['recipient_email'].lower()), offset, limit
+    )
+    first_dates = formatter.format_batch([r['first_sent'] for r in recipients])
+    last_dates = formatter.format_batch([r['last_sent'] for r in recipients])
+    return [
+        {
+            'recipient_email': r['recipient_email'],
+            'recipient_name': r['recipient_name'],
+            'message_count': r['message_count'],
+            'thread_count': len(r['thread_ids']),
+            'first_sent_date': first_date,
+            'last_sent_date': last_date
+        }
+        for r, first_date, last_date in zip(recipients, first_dates, last_dates)
+    ]
+
+def thread_summary_rows(aggregates, formatter, offset=0, limit=None):
+    """Per-thread summary rows, most recently active first"""
+    threads = top_summary_entries(aggregates['threads'].values(), lambda t: -t['last_sent'], offset, limit)
+    first_dates = formatter.format_batch([t['first_sent'] for t in threads])
+    last_dates = formatter.format_batch([t['last_sent'] for t in threads])
+    return [
+        {
+            'thread_id': t['thread_id'],
+            'message_count': t['message_count'],
+            'recipient_count': len(t['recipients']),
+            'first_sent_date': first_date,
+            'last_sent_date': last_date
+        }
+        for t, first_date, last_date in zip(threads, first_dates, last_dates)
+    ]
+
+def write_summary_csv(rows, columns, output):
+    """Write summary rows as CSV to a text file-like output"""
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+
+def write_jsonl(emails, formatter, output):
+    """Write the email list as JSON Lines (one record per line, raw epoch kept)"""
+    emails = sorted(emails, key=lambda x: x['sent_timestamp'])
+    sent_dates = formatter.format_batch([email_data['sent_timestamp'] for email_data in emails])
+    for sent_date, email_data in zip(sent_dates, emails):
+        output.write(json.dumps({**email_data, 'sent_date': sent_date}) + '\n')
+
+def write_csv(emails, formatter, output):
+    """Write the email list as CSV to a text file-like output"""
     writer = csv.writer(output)
     writer.writerow(['sent_date', 'recipient_name', 'recipient_email', 'thread_id', 'message_id'])
     
-    # Sort by date and write
-    for email_data in sorted(emails, key=lambda x: x['sent_date']):
-        writer.writerow([email_data['sent_date'], email_data['recipient_name'], email_data['recipient_email'], email_data['thread_id'], email_data['message_id']])
+    # Sort by raw timestamp, then format the whole column in one batch
+    emails = sorted(emails, key=lambda x: x['sent_timestamp'])
+    sent_dates = formatter.format_batch([email_data['sent_timestamp'] for email_data in emails])
+    writer.writerows(
+        [sent_date, email_data['recipient_name'], email_data['recipient_email'], email_data['thread_id'], email_data['message_id']]
+        for sent_date, email_data in zip(sent_dates, emails)
+    )
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """S3 (or S3-compatible, via EXPORT_S3_ENDPOINT_URL) client for the export sink"""
+    import boto3
+    return boto3.client('s3', endpoint_url=EXPORT_S3_ENDPOINT_URL, region_name=EXPORT_S3_REGION)
+
+def export_object_key(generation_id, file_index):
+    """Object key for an export file; derivable from the download URL alone"""
+    return f"{EXPORT_S3_PREFIX}{generation_id}/{file_index}"
+
+class S3MultipartWriter:
+    """Text file-like sink that streams into an S3 multipart upload.
+    
+    Written text is buffered until a part is full and uploaded then, so only
+    one part is held in memory. Used as a context manager the upload is
+    completed on success and aborted if writing fails.
+    """
+    
+    def __init__(self, client, bucket, key, content_type, content_disposition, part_size=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size or EXPORT_S3_PART_SIZE, S3_MIN_PART_SIZE)
+        self.parts = []
+        self.size = 0
+        self._buffer = bytearray()
+        upload = client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type, ContentDisposition=content_disposition
+        )
+        self.upload_id = upload['UploadId']
+    
+    def write(self, text):
+        data = text.encode()
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(text)
+    
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self._buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self._buffer = bytearray()
+    
+    def close(self):
+        try:
+            # The last part may be smaller than the minimum part size
+            if self._buffer or not self.parts:
+                self._upload_part()
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+        except Exception:
+            # An incomplete upload keeps accruing storage until aborted
+            self.abort()
+            raise
+    
+    def abort(self):
+        # Best effort: never mask the error that caused the abort
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            print(f"Could not abort multipart upload {self.upload_id} for {self.key}: {e}")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_export_file(generation_id, file_index, filename, media_type, write_rows):
+    """Run write_rows(output) into the configured sink and return the file_info"""
+    if EXPORT_S3_BUCKET:
+        key = export_object_key(generation_id, file_index)
+        with S3MultipartWriter(get_s3_client(), EXPORT_S3_BUCKET, key, media_type, f"attachment; filename={filename}") as output:
+            write_rows(output)
+        return {'filename': filename, 's3_key': key, 'size': output.size, 'media_type': media_type}
+    
+    output = io.StringIO()
+    write_rows(output)
+    return {'filename': filename, 'csv_content': output.getvalue(), 'media_type': media_type}
+
+def s3_download_response(key, check_exists=False):
+    """Presigned redirect (or proxy stream) for an export object"""
+    from botocore.exceptions import ClientError
     
-    return output.getvalue()
+    client = get_s3_client()
+    try:
+        if EXPORT_S3_PRESIGN:
+            if check_exists:
+                client.head_object(Bucket=EXPORT_S3_BUCKET, Key=key)
+            url = client.generate_presigned_url(
+                'get_object', Params={'Bucket': EXPORT_S3_BUCKET, 'Key': key}, ExpiresIn=EXPORT_S3_URL_TTL
+            )
+            return RedirectResponse(url=url)
+        
+        obj = client.get_object(Bucket=EXPORT_S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            raise HTTPException(status_code=404, detail="File not found")
+        raise
+    
+    headers = {}
+    if obj.get('ContentDisposition'):
+        headers['Content-Disposition'] = obj['ContentDisposition']
+    return StreamingResponse(
+        obj['Body'].iter_chunks(chunk_size=64 * 1024),
+        media_type=obj.get('ContentType', "text/csv"),
+        headers=headers
+    )
+
+def get_export_db():
+    """Open a connection to the local export store"""
+    conn = sqlite3.connect(EXPORT_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
 
-async def process_single_month(service, month, year, status, base_progress):
-    """Process emails for a single month"""
+def init_export_db():
+    """Create the export store tables and indexes if missing"""
+    with get_export_db() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS email_records (
+                account_email TEXT NOT NULL COLLATE NOCASE,
+                message_id TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                recipient_email TEXT NOT NULL COLLATE NOCASE,
+                recipient_name TEXT NOT NULL,
+                sent_timestamp INTEGER NOT NULL,
+                generation_id TEXT NOT NULL,
+                PRIMARY KEY (account_email, message_id)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_records_recipient ON email_records (account_email, recipient_email, sent_timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_records_sent ON email_records (account_email, sent_timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_records_thread ON email_records (account_email, thread_id, sent_timestamp)")
+    conn.close()
+
+def store_email_records(account_email, generation_id, emails):
+    """Upsert exported records into the local store (re-exports replace rows)"""
     try:
-        # Date range for month
-        start_date = date(year, month, 1)
-        if month == 12:
-            end_date = date(year + 1, 1, 1)
-        else:
-            end_date = date(year, month + 1, 1)
+        with get_export_db() as conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO email_records
+                    (account_email, message_id, thread_id, recipient_email, recipient_name, sent_timestamp, generation_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (account_email, e['message_id'], e['thread_id'], e['recipient_email'], e['recipient_name'], e['sent_timestamp'], generation_id)
+                    for e in emails
+                ]
+            )
+        conn.close()
+    except sqlite3.Error as e:
+        # The export itself still succeeds; the store is a convenience index
+        print(f"Error storing records for {account_email}: {e}")
+
+def query_email_records(account_email, formatter, recipient=None, thread_id=None, start_date=None, end_date=None, limit=100, cursor=None, include_count=True):
+    """Filter, count and page stored records, newest first.
+    
+    Paging is keyset based: cursor is the next_cursor of the previous page
+    ("<sent_timestamp>:<message_id>") so deep pages stay index-only.
+    """
+    where = ["account_email = ?"]
+    params = [account_email]
+    
+    if recipient:
+        where.append("recipient_email = ?")
+        params.append(recipient)
+    if thread_id:
+        where.append("thread_id = ?")
+        params.append(thread_id)
+    if start_date:
+        where.append("sent_timestamp >= ?")
+        params.append(int(datetime.combine(start_date, datetime.min.time(), formatter.tz).timestamp() * 1000))
+    if end_date:
+        # end_date is inclusive
+        where.append("sent_timestamp < ?")
+        params.append(int(datetime.combine(end_date + timedelta(days=1), datetime.min.time(), formatter.tz).timestamp() * 1000))
+    
+    where_sql = " AND ".join(where)
+    page_where_sql = where_sql
+    page_params = list(params)
+    if cursor:
+        cursor_timestamp, cursor_message_id = cursor.split(':', 1)
+        page_where_sql += " AND (sent_timestamp, message_id) < (?, ?)"
+        page_params.extend([int(cursor_timestamp), cursor_message_id])
+    
+    with get_export_db() as conn:
+        total = None
+        if include_count:
+            total = conn.execute(f"SELECT COUNT(*) FROM email_records WHERE {where_sql}", params).fetchone()[0]
+        rows = conn.execute(
+            f"""
+            SELECT sent_timestamp, recipient_name, recipient_email, thread_id, message_id
+            FROM email_records WHERE {page_where_sql}
+            ORDER BY sent_timestamp DESC, message_id DESC
+            LIMIT ?
+            """,
+            page_params + [limit]
+        ).fetchall()
+    conn.close()
+    
+    records = [dict(row) for row in rows]
+    for record, sent_date in zip(records, formatter.format_batch([r['sent_timestamp'] for r in records])):
+        record['sent_date'] = sent_date
+    next_cursor = None
+    if len(records) == limit:
+        next_cursor = f"{records[-1]['sent_timestamp']}:{records[-1]['message_id']}"
+    
+    return {'total': total, 'records': records, 'next_cursor': next_cursor}
+
+def resolve_date_range(data, mode):
+    """Resolve a start-generation payload into (start_date, end_date, file_label).
+    
+    end_date is exclusive, matching Gmail's before: operator. Accepts either
+    explicit start_date/end_date (YYYY-MM-DD, end inclusive) or the month/year
+    pair used by the single and multi month modes.
+    """
+    today = date.today()
+    
+    if data.get('start_date'):
+        start_date = date.fromisoformat(data['start_date'])
+        last_day = date.fromisoformat(data['end_date']) if data.get('end_date') else today
+        if last_day < start_date:
+            raise ValueError("end_date must not be before start_date")
+        end_date = last_day + timedelta(days=1)
+        file_label = f"{start_date.isoformat()}_to_{last_day.isoformat()}"
+        return start_date, end_date, file_label
+    
+    month = int(data['month'])
+    year = int(data['year'])
+    start_date = date(year, month, 1)
+    start_name = f"{calendar.month_name[month].lower()}_{year}"
+    
+    if mode == 'single':
+        # Single month only
+        end_date = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        return start_date, end_date, start_name
+    
+    # Multiple months from start up to and including today
+    end_date = today + timedelta(days=1)
+    if start_date >= end_date:
+        raise ValueError("Start month cannot be in the future")
+    if (start_date.year, start_date.month) == (today.year, today.month):
+        return start_date, end_date, start_name
+    end_name = f"{calendar.month_name[today.month].lower()}_{today.year}"
+    return start_date, end_date, f"{start_name}_to_{end_name}"
+
+def build_sent_query(start_date, end_date):
+    """Gmail search query for sent mail in [start_date, end_date)"""
+    return f"in:sent after:{start_date.strftime('%Y/%m/%d')} before:{end_date.strftime('%Y/%m/%d')}"
+
+def format_window_label(start_date, end_date):
+    """Human readable label for a query window"""
+    last_day = end_date - timedelta(days=1)
+    if start_date.day == 1 and end_date.day == 1 and (last_day.year, last_day.month) == (start_date.year, start_date.month):
+        return f"{calendar.month_name[start_date.month]} {start_date.year}"
+    if start_date == last_day:
+        return start_date.strftime('%d %b %Y')
+    return f"{start_date.strftime('%d %b %Y')} - {last_day.strftime('%d %b %Y')}"
+
+def serialize_window(window):
+    """JSON friendly copy of a planned query window"""
+    return {
+        'start_date': window['start_date'].isoformat(),
+        'end_date': (window['end_date'] - timedelta(days=1)).isoformat(),
+        'estimate': window['estimate'],
+        'message_count': window.get('message_count'),
+        'label': window['label']
+    }
+
+async def estimate_window_size(service, start_date, end_date, status):
+    """Cheap list call returning Gmail's resultSizeEstimate for a window"""
+    from googleapiclient.errors import HttpError
+    
+    query = build_sent_query(start_date, end_date)
+    profile = status.get('profile')
+    
+    while True:
+        try:
+            await acquire_quota(status, 'list')
+            with profile_phase(profile, 'gmail_list'):
+                result = await run_blocking(status, service.users().messages().list(userId='me', q=query, maxResults=1).execute)
+            return result.get('resultSizeEstimate', 0)
+        except HttpError as e:
+            if e.resp.status == 429:
+                print(f"Rate limit hit while planning, waiting 60 seconds...")
+                status['message'] = 'Rate limit reached while planning, waiting...'
+                with profile_phase(profile, 'rate_limit_wait'):
+                    await asyncio.sleep(60)
+                continue
+            print(f"Could not estimate {query}: {e}")
+            return None
+
+async def plan_query_windows(service, start_date, end_date, status):
+    """Split [start_date, end_date) into work units of roughly TARGET_WINDOW_MESSAGES.
+    
+    Busy ranges are split by their resultSizeEstimate (down to single days),
+    quiet ranges stay whole, and adjacent small leaves are merged back together.
+    """
+    leaves = []
+    pending = [(start_date, end_date)]
+    
+    while pending:
+        window_start, window_end = pending.pop()
+        estimate = await estimate_window_size(service, window_start, window_end, status)
+        span_days = (window_end - window_start).days
+        
+        if estimate is None:
+            # Estimation failed - keep the range whole and let the fetch report errors
+            leaves.append((window_start, window_end, 0))
+            continue
+        
+        if estimate <= TARGET_WINDOW_MESSAGES or span_days <= 1:
+            leaves.append((window_start, window_end, estimate))
+            continue
         
+        # Split proportionally to how far over target this range is
+        parts = min(span_days, -(-estimate // TARGET_WINDOW_MESSAGES))
+        step = span_days / parts
+        boundaries = [window_start + timedelta(days=round(step * i)) for i in range(parts)] + [window_end]
+        for sub_start, sub_end in zip(boundaries, boundaries[1:]):
+            if sub_start < sub_end:
+                pending.append((sub_start, sub_end))
+        
+        await asyncio.sleep(0.05)
+    
+    leaves.sort()
+    
+    # Merge neighbouring quiet windows so they don't cost a unit each
+    merged = []
+    for window_start, window_end, estimate in leaves:
+        if merged and merged[-1][1] == window_start and merged[-1][2] + estimate <= TARGET_WINDOW_MESSAGES:
+            merged[-1] = (merged[-1][0], window_end, merged[-1][2] + estimate)
+        else:
+            merged.append((window_start, window_end, estimate))
+    
+    return [
+        {
+            'start_date': window_start,
+            'end_date': window_end,
+            'estimate': estimate,
+            'label': format_window_label(window_start, window_end)
+        }
+        for window_start, window_end, estimate in merged
+    ]
+
+def record_fetch_error(status, label, reason):
+    """Note mail that could not be fetched; the job still completes but is flagged incomplete"""
+    print(f"Fetch error in {label}: {reason}")
+    status['fetch_errors'].append(f"{label}: {reason}")
+
+async def process_date_range(service, window, status):
+    """Process emails for a single planned query window"""
+    from googleapiclient.errors import HttpError
+    
+    label = window['label']
+    profile = status.get('profile')
+    try:
         # Search sent emails
-        query = f"in:sent after:{start_date.strftime('%Y/%m/%d')} before:{end_date.strftime('%Y/%m/%d')}"
+        query = build_sent_query(window['start_date'], window['end_date'])
         print(f"Gmail API Query: {query}")
         
         # Get all messages with pagination
@@ -820,7 +2134,7 @@ async def process_single_month(service, month, year, status, base_progress):
         
         while True:
             page_count += 1
-            status['message'] = f'Fetching {calendar.month_name[month]} {year} emails (page {page_count})...'
+            status['message'] = f'Fetching {label} emails (page {page_count})...'
             
             request_params = {
                 'userId': 'me',
@@ -831,19 +2145,22 @@ async def process_single_month(service, month, year, status, base_progress):
                 request_params['pageToken'] = page_token
             
             try:
-                messages_result = service.users().messages().list(**request_params).execute()
+                await acquire_quota(status, 'list')
+                with profile_phase(profile, 'gmail_list'):
+                    messages_result = await run_blocking(status, service.users().messages().list(**request_params).execute)
                 messages = messages_result.get('messages', [])
             except HttpError as e:
                 if e.resp.status == 429:
                     print(f"Rate limit hit, waiting 60 seconds...")
-                    status['message'] = f'Rate limit reached, waiting... ({calendar.month_name[month]} {year})'
-                    await asyncio.sleep(60)
+                    status['message'] = f'Rate limit reached, waiting... ({label})'
+                    with profile_phase(profile, 'rate_limit_wait'):
+                        await asyncio.sleep(60)
                     continue
                 elif e.resp.status == 403:
-                    print(f"Quota exceeded: {e}")
+                    record_fetch_error(status, label, f"quota exceeded while listing messages: {e}")
                     return None
                 else:
-                    print(f"Gmail API error: {e}")
+                    record_fetch_error(status, label, f"Gmail API error while listing messages: {e}")
                     return None
             
             if not messages:
@@ -856,9 +2173,15 @@ async def process_single_month(service, month, year, status, base_progress):
             if not page_token:
                 break
             
-            await asyncio.sleep(0.1)
+            with profile_phase(profile, 'throttle'):
+                await asyncio.sleep(0.1)
+        
+        print(f"Total messages found for {label}: {len(all_messages)}")
         
-        print(f"Total messages found for {calendar.month_name[month]} {year}: {len(all_messages)}")
+        # Swap this window's estimate for the real count in the expected total
+        window['message_count'] = len(all_messages)
+        status['expected_messages'] += len(all_messages) - window['estimate']
+        update_progress(status)
         
         if not all_messages:
             return []
@@ -868,39 +2191,45 @@ async def process_single_month(service, month, year, status, base_progress):
         total_messages = len(all_messages)
         
         for i, message in enumerate(all_messages):
-            if i % 10 == 0:  # Update progress every 10 emails
-                progress = base_progress + (i / total_messages) * (70 / len(status['months_to_process']))
-                status['progress'] = min(progress, 90)
-                status['message'] = f'Processing {calendar.month_name[month]} {year} email {i+1} of {total_messages}...'
+            status['message'] = f'Processing {label} email {i+1} of {total_messages}...'
             
             try:
-                email_data = get_email_details(service, message['id'])
+                await acquire_quota(status, 'get')
+                email_data = await run_blocking(status, get_email_details, service, message['id'], profile)
                 if email_data:
                     all_emails.append(email_data)
+                    with profile_phase(profile, 'aggregate'):
+                        update_aggregates(status['aggregates'], email_data)
             except HttpError as e:
                 if e.resp.status == 429:
                     print(f"Rate limit hit while processing message, waiting 30 seconds...")
-                    await asyncio.sleep(30)
+                    with profile_phase(profile, 'rate_limit_wait'):
+                        await asyncio.sleep(30)
                     try:
-                        email_data = get_email_details(service, message['id'])
+                        await acquire_quota(status, 'get')
+                        email_data = await run_blocking(status, get_email_details, service, message['id'], profile)
                         if email_data:
                             all_emails.append(email_data)
-                    except:
-                        print(f"Failed to process message {message['id']} after retry")
+                            update_aggregates(status['aggregates'], email_data)
+                    except Exception as retry_error:
+                        record_fetch_error(status, label, f"message {message['id']} failed after retry: {retry_error}")
                 elif e.resp.status == 403:
-                    print(f"Quota exceeded while processing messages")
+                    record_fetch_error(status, label, f"quota exceeded after {i} of {total_messages} messages")
                     return all_emails  # Return what we have so far
                 else:
-                    print(f"Error processing message {message['id']}: {e}")
+                    record_fetch_error(status, label, f"message {message['id']} failed: {e}")
             except Exception as e:
-                print(f"Unexpected error processing message {message['id']}: {e}")
+                record_fetch_error(status, label, f"message {message['id']} failed: {e}")
+            
+            with profile_phase(profile, 'throttle'):
+                await asyncio.sleep(0.05)
             
-            await asyncio.sleep(0.05)
+            update_progress(status, 1)
         
         return all_emails
         
     except Exception as e:
-        print(f"Error processing month {month}/{year}: {e}")
+        record_fetch_error(status, label, f"window abandoned: {e}")
         return []
 
 
@@ -0,0 +1,174 @@
+"""Export sink against an in-memory, MinIO-style S3 stand-in."""
+import asyncio
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+
+import main
+
+
+class FakeS3:
+    """Enough of the S3 API for the export sink, enforcing the multipart part minimum"""
+
+    def __init__(self):
+        self.objects = {}  # key -> (body, content type, content disposition)
+        self.uploads = {}  # upload id -> {'key', 'parts', 'meta'}
+        self.part_sizes = []
+        self.fail_complete = False
+        self._next_upload = 0
+
+    def create_multipart_upload(self, Bucket, Key, ContentType, ContentDisposition):
+        self._next_upload += 1
+        upload_id = f"upload-{self._next_upload}"
+        self.uploads[upload_id] = {'key': Key, 'parts': {}, 'meta': (ContentType, ContentDisposition)}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId]['parts'][PartNumber] = Body
+        self.part_sizes.append(len(Body))
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        if self.fail_complete:
+            raise ClientError({'Error': {'Code': 'InternalError'}}, 'CompleteMultipartUpload')
+        upload = self.uploads[UploadId]
+        parts = [upload['parts'][part['PartNumber']] for part in MultipartUpload['Parts']]
+        if any(len(part) < main.S3_MIN_PART_SIZE for part in parts[:-1]):
+            raise ClientError({'Error': {'Code': 'EntityTooSmall'}}, 'CompleteMultipartUpload')
+        del self.uploads[UploadId]
+        self.objects[Key] = (b''.join(parts), *upload['meta'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        del self.uploads[UploadId]
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        body, content_type, content_disposition = self.objects[Key]
+
+        class Body:
+            def iter_chunks(self, chunk_size):
+                for start in range(0, len(body), chunk_size):
+                    yield body[start:start + chunk_size]
+
+        return {'Body': Body(), 'ContentType': content_type, 'ContentDisposition': content_disposition}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"http://minio.local/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+    monkeypatch.setattr(main, 'EXPORT_S3_BUCKET', 'exports-bucket')
+    monkeypatch.setattr(main, 'EXPORT_S3_PRESIGN', True)
+    monkeypatch.setattr(main, 'get_s3_client', lambda: fake)
+    return fake
+
+
+def sample_emails(count):
+    return [
+        {
+            'sent_timestamp': 1735700000000 + i * 1000,
+            'recipient_name': f'Recipient {i}',
+            'recipient_email': f'user{i}@example.com',
+            'thread_id': f'thread{i // 3}',
+            'message_id': f'message{i}'
+        }
+        for i in range(count)
+    ]
+
+
+def read_streaming_body(response):
+    async def collect():
+        return b''.join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(collect())
+
+
+def test_multipart_upload_matches_csv(s3):
+    emails = sample_emails(150000)  # ~12 MiB of CSV, so several parts
+    formatter = main.get_sent_date_formatter()
+
+    file_info = main.write_export_file(
+        'gen1', 0, 'export.csv', 'text/csv', lambda output: main.write_csv(emails, formatter, output)
+    )
+
+    expected = io.StringIO()
+    main.write_csv(emails, formatter, expected)
+    body, content_type, content_disposition = s3.objects['exports/gen1/0']
+    assert body == expected.getvalue().encode()
+    assert file_info == {'filename': 'export.csv', 's3_key': 'exports/gen1/0', 'size': len(body), 'media_type': 'text/csv'}
+    assert (content_type, content_disposition) == ('text/csv', 'attachment; filename=export.csv')
+    assert len(s3.part_sizes) >= 2
+    assert all(size >= main.S3_MIN_PART_SIZE for size in s3.part_sizes[:-1])
+    assert not s3.uploads
+
+
+def test_failed_write_aborts_upload(s3):
+    def write_rows(output):
+        output.write('partial row\n')
+        raise RuntimeError('writer failed')
+
+    with pytest.raises(RuntimeError):
+        main.write_export_file('gen2', 0, 'export.csv', 'text/csv', write_rows)
+    assert not s3.uploads
+    assert 'exports/gen2/0' not in s3.objects
+
+
+def test_failed_complete_aborts_upload(s3):
+    s3.fail_complete = True
+
+    with pytest.raises(ClientError):
+        main.write_export_file('gen3', 0, 'export.csv', 'text/csv', lambda output: output.write('a,b\n'))
+    assert not s3.uploads
+    assert 'exports/gen3/0' not in s3.objects
+
+
+def test_presigned_download(s3):
+    s3.objects['exports/gen4/0'] = (b'a,b\n', 'text/csv', 'attachment; filename=x.csv')
+    main.generation_status['gen4'] = {'completed_files': [{'filename': 'x.csv', 's3_key': 'exports/gen4/0'}]}
+    try:
+        response = main.download_csv('gen4', 0)
+    finally:
+        del main.generation_status['gen4']
+
+    assert response.status_code == 307
+    assert response.headers['location'] == f"http://minio.local/exports-bucket/exports/gen4/0?X-Amz-Expires={main.EXPORT_S3_URL_TTL}"
+
+
+def test_download_from_another_replica(s3):
+    # Unknown to this process, but present in the store
+    s3.objects['exports/gen5/1'] = (b'a,b\n', 'text/csv', 'attachment; filename=x_recipients.csv')
+
+    response = main.download_csv('gen5', 1)
+
+    assert response.status_code == 307
+    assert 'exports/gen5/1' in response.headers['location']
+
+
+def test_proxy_download(s3, monkeypatch):
+    monkeypatch.setattr(main, 'EXPORT_S3_PRESIGN', False)
+    body = b'sent_date,recipient_name\n' * 10000
+    s3.objects['exports/gen6/0'] = (body, 'text/csv', 'attachment; filename=x.csv')
+
+    response = main.download_csv('gen6', 0)
+
+    assert response.headers['content-disposition'] == 'attachment; filename=x.csv'
+    assert response.media_type == 'text/csv'
+    assert read_streaming_body(response) == body
+
+
+@pytest.mark.parametrize('presign', [True, False])
+def test_missing_object_is_404(s3, monkeypatch, presign):
+    monkeypatch.setattr(main, 'EXPORT_S3_PRESIGN', presign)
+
+    with pytest.raises(HTTPException) as error:
+        main.download_csv('missing', 0)
+    assert error.value.status_code == 404
@@ -0,0 +1,60 @@
+"""SentDateFormatter.format_batch must match per-row strftime exactly."""
+import random
+from datetime import datetime
+
+import pytest
+
+import main
+
+TIMEZONES = ['Asia/Kolkata', 'America/New_York', 'Europe/London', 'Australia/Lord_Howe', 'UTC']
+DATE_FORMATS = [
+    main.DEFAULT_DATE_FORMAT,
+    '%Y-%m-%d %H:%M:%S',
+    '%-d/%-m/%y %-H:%-M:%-S',
+    '%a %d %b %Y %H:%M:%S %Z %z',
+    '%A %B %j %%H {literal}',
+    '%Y-%m-%d %P %H',
+    '%Y-%m-%d %-k:%M',
+    '%I:%M:%S %p',
+    '%c',
+    '%s',
+    '%H:%M:%S.%f',
+    '100%',
+]
+
+
+def sample_timestamps(count=5000, seed=7):
+    """Random ms timestamps, half of them packed around DST transitions"""
+    rng = random.Random(seed)
+    timestamps = [rng.randrange(0, 2208988800000) for _ in range(count // 2)]  # 1970-2040
+    transitions = [
+        datetime(2024, 3, 10, 7).timestamp(), datetime(2024, 11, 3, 6).timestamp(),  # New York
+        datetime(2024, 3, 31, 1).timestamp(), datetime(2024, 10, 27, 1).timestamp(),  # London
+        datetime(2024, 4, 6, 15).timestamp(), datetime(2024, 10, 5, 15).timestamp(),  # Lord Howe
+    ]
+    for _ in range(count - len(timestamps)):
+        centre = rng.choice(transitions) * 1000
+        timestamps.append(int(centre + rng.randrange(-2 * 86400000, 2 * 86400000)))
+    return timestamps
+
+
+@pytest.mark.parametrize('date_format', DATE_FORMATS)
+@pytest.mark.parametrize('tz_name', TIMEZONES)
+def test_format_batch_matches_strftime(tz_name, date_format):
+    formatter = main.SentDateFormatter(tz_name, date_format)
+    timestamps = sample_timestamps()
+    expected = [datetime.fromtimestamp(ts / 1000, formatter.tz).strftime(date_format) for ts in timestamps]
+    assert formatter.format_batch(timestamps) == expected
+
+
+@pytest.mark.parametrize('date_format, fast', [
+    (main.DEFAULT_DATE_FORMAT, True),
+    ('%-d/%-m/%y %-H:%-M:%-S', True),
+    ('%a %d %b %Y %H:%M:%S %Z %z', True),
+    ('%Y-%m-%d %P %H', False),
+    ('%Y-%m-%d %-k:%M', False),
+    ('%I:%M %p', False),
+    ('100%', False),
+])
+def test_fast_path_only_for_allowlisted_directives(date_format, fast):
+    assert main.SentDateFormatter('UTC', date_format)._fast is fast